@@ -0,0 +1,56 @@
+"""
+Micro-benchmark for parsing sample rows, run on the CSV file bundled with the tests.
+
+Usage:
+
+    python benchmarks/parse_rows.py [REPEAT]
+
+Reports the average cost per row of `File.iter_samples` - i.e. CSV parsing, `Sample`
+construction (typing of cells and extraction of citation markers) and errata fixing - as
+well as of `Sample` construction alone.
+"""
+import sys
+import time
+import pathlib
+
+from pygeoroc import GEOROC
+from pygeoroc.api import Sample, SampleData, Columns, column_name, SAMPLE_COLS
+
+REPOS = pathlib.Path(__file__).parent.parent / 'tests' / 'repos'
+
+
+def timeit(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        n = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / n * 1e6
+
+
+def main(repeat=10):
+    api = GEOROC(REPOS)
+    f = next(api.iter_files())
+    rows = list(f.reader(api).iter_rows())
+    keys = [column_name(k) for k in rows[0]]
+    id_, name, citations = [keys.index(k) for k in SAMPLE_COLS]
+    positions = [i for i, k in enumerate(keys) if k not in SAMPLE_COLS]
+    header = Columns(keys[i] for i in positions)
+
+    def construct():
+        for row in rows[1:]:
+            Sample(
+                id=row[id_],
+                name=row[name],
+                citations=row[citations],
+                data=SampleData(header, [row[j] for j in positions]))
+        return len(rows) - 1
+
+    print('File.iter_samples: {:.1f}µs/row'.format(
+        timeit(lambda: sum(1 for _ in f.iter_samples(api)), repeat)))
+    print('Sample construction: {:.1f}µs/row'.format(timeit(construct, repeat)))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
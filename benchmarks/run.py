@@ -0,0 +1,231 @@
+"""
+Benchmark the parse -> errata -> load pipeline on a synthetic GEOROC repository.
+
+Usage:
+
+    python benchmarks/run.py [--rows N ...] [--out results.json] [--compare baseline.json]
+
+Each stage is run `--repeat` times to measure wall time (reporting the best run), and once
+more - with `tracemalloc` enabled - to measure peak memory allocated by Python code. With
+`--rss`, each stage is also run in a fresh process, to measure its peak resident set size -
+which includes memory allocated by SQLite. Results are written as JSON. If a baseline is
+given, stages which got slower than the baseline by more than `--tolerance` are reported,
+and the script exits with status 1.
+"""
+import gc
+import os
+import sys
+import json
+import time
+import shutil
+import pathlib
+import resource
+import subprocess
+import logging
+import platform
+import argparse
+import tempfile
+import contextlib
+import tracemalloc
+
+os.environ.setdefault('TQDM_DISABLE', '1')
+sys.path.insert(0, str(pathlib.Path(__file__).parent))
+import synthetic  # noqa: E402
+
+import pygeoroc  # noqa: E402
+from pygeoroc import GEOROC  # noqa: E402
+from pygeoroc.api import Columns, SampleData, Sample, column_name, SAMPLE_COLS  # noqa: E402
+from pygeoroc.db import Database  # noqa: E402
+from pygeoroc.errata import Plan  # noqa: E402
+from pygeoroc.__main__ import main as georoc  # noqa: E402
+
+
+def file_iter_samples(api):
+    return sum(1 for f in api.iter_files() for _ in f.iter_samples(api))
+
+
+def errata_fix(api):
+    """
+    Time applying the compiled errata to samples which have been read before.
+
+    Note: Peak memory for this stage includes reading the samples.
+    """
+    n = 0
+    for f in api.iter_files():
+        rows = list(f.reader(api).iter_rows())
+        keys = [column_name(k) for k in rows[0]]
+        id_, name, citations = [keys.index(k) for k in SAMPLE_COLS]
+        positions = [i for i, k in enumerate(keys) if k not in SAMPLE_COLS]
+        header = Columns(keys[i] for i in positions)
+        samples = [
+            Sample(
+                id=row[id_],
+                name=row[name],
+                citations=row[citations],
+                data=SampleData(header, [row[j] for j in positions])) for row in rows[1:]]
+        plan = Plan.compile(f, api, header.names)
+        start = time.perf_counter()
+        for sample in samples:
+            plan.apply(sample.data)
+        plan.report(stdout=None)
+        n += len(samples)
+        yield time.perf_counter() - start
+    yield n
+
+
+def georoc_iter_samples(api):
+    return sum(1 for _ in api.iter_samples())
+
+
+def database_create(api):
+    if api.dbpath.exists():
+        api.dbpath.unlink()
+    Database(api.dbpath).create(api)
+    return api.dbquery('SELECT count(*) AS n FROM sample')[0]['n']
+
+
+def ls_samples(api):
+    # Measure scanning (and checksumming) the files, rather than reading the cached counts and
+    # checksums of a previous run:
+    for name in ['counts.json', 'checksums.json']:
+        if api.path(name).exists():
+            api.path(name).unlink()
+    with contextlib.redirect_stdout(None):
+        georoc(['--repos', str(api.repos), 'ls', '--samples'], log=logging.getLogger(__name__))
+    return len(list(api.iter_files()))
+
+
+STAGES = [
+    ('File.iter_samples', file_iter_samples, 'samples'),
+    ('errata.fix', errata_fix, 'samples'),
+    ('GEOROC.iter_samples', georoc_iter_samples, 'unique samples'),
+    ('Database.create', database_create, 'rows'),
+    ('georoc ls --samples', ls_samples, 'files'),
+]
+
+
+def run_stage(func, api):
+    """
+    :return: pair (seconds, count). Functions may time themselves, by yielding times and \
+    finally the count.
+    """
+    gc.collect()
+    start = time.perf_counter()
+    res = func(api)
+    if isinstance(res, int):
+        return time.perf_counter() - start, res
+    *times, n = list(res)
+    return sum(times), n
+
+
+def measure_rss(api, name):
+    """
+    :return: Peak resident set size of a process running the stage, in bytes.
+    """
+    return int(subprocess.check_output(
+        [sys.executable, __file__, '--rss-child', name, str(api.repos)]).decode().split()[-1])
+
+
+def rss_child(name, repos):
+    run_stage(dict((s[0], s[1]) for s in STAGES)[name], GEOROC(repos))
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS, in KB elsewhere:
+    print(maxrss if sys.platform == 'darwin' else maxrss * 1024)
+
+
+def measure(api, stages, repeat=3, rss=False):
+    results = {}
+    for name, func, unit in stages:
+        seconds, count = min(run_stage(func, api) for _ in range(repeat))
+        tracemalloc.start()
+        run_stage(func, api)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results[name] = dict(
+            seconds=round(seconds, 4),
+            count=count,
+            unit=unit,
+            per_second=round(count / seconds, 1) if seconds else None,
+            peak_memory=peak)
+        if rss:
+            results[name]['peak_rss'] = measure_rss(api, name)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, res in results.items():
+        base = baseline['results'].get(name)
+        if base and res['seconds'] > base['seconds'] * (1 + tolerance):
+            regressions.append('{}: {:.3f}s vs. {:.3f}s in baseline'.format(
+                name, res['seconds'], base['seconds']))
+    return regressions
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    synthetic.register(parser)
+    parser.add_argument('--out', help='Path to write the JSON results to (default: stdout)')
+    parser.add_argument('--compare', help='Path of JSON results of a baseline run')
+    parser.add_argument(
+        '--tolerance',
+        type=float,
+        default=0.2,
+        help='Slowdown relative to the baseline to be reported as regression')
+    parser.add_argument(
+        '--repeat', type=int, default=3, help='Number of runs to measure the time of a stage')
+    parser.add_argument(
+        '--stage',
+        action='append',
+        choices=[s[0] for s in STAGES],
+        help='Only run the specified stage(s)')
+    parser.add_argument(
+        '--rss',
+        action='store_true',
+        default=False,
+        help='Also measure the peak resident set size of each stage, running it in a new process')
+    parser.add_argument('--rss-child', nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args(args)
+
+    if args.rss_child:
+        rss_child(*args.rss_child)
+        return 0
+
+    tmp = pathlib.Path(tempfile.mkdtemp())
+    try:
+        api = GEOROC(synthetic.create(tmp / 'repos', seed=args.seed, **synthetic.params(args)))
+        results = dict(
+            meta=dict(
+                pygeoroc=pygeoroc.__version__,
+                python=platform.python_version(),
+                platform=platform.platform(),
+                date=time.strftime('%Y-%m-%dT%H:%M:%S'),
+                repeat=args.repeat,
+                params=synthetic.params(args)),
+            results=measure(
+                api,
+                [s for s in STAGES if not args.stage or s[0] in args.stage],
+                repeat=args.repeat,
+                rss=args.rss))
+    finally:
+        shutil.rmtree(str(tmp))
+
+    out = json.dumps(results, indent=4)
+    if args.out:
+        pathlib.Path(args.out).write_text(out)
+    else:
+        print(out)
+
+    if args.compare:
+        baseline = json.loads(pathlib.Path(args.compare).read_text())
+        if baseline['meta']['params'] != results['meta']['params']:
+            print('WARNING: Baseline was run with different parameters', file=sys.stderr)
+        regressions = compare(results['results'], baseline, args.tolerance)
+        for msg in regressions:
+            print('REGRESSION: ' + msg, file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,153 @@
+"""
+Create a synthetic GEOROC repository with CSV files shaped like the GEOROC precompilations:
+
+- cp1252 encoded, with CR line terminators,
+- a header with hundreds of columns, most of them sparsely filled,
+- citation markers in sample names and values,
+- an `Abbreviations` and `References:` trailer,
+- sample IDs duplicated across files.
+
+Usage:
+
+    python benchmarks/synthetic.py OUTDIR [--files N] [--rows N] [--columns N]
+"""
+import json
+import random
+import hashlib
+import pathlib
+import argparse
+
+META_COLS = [
+    'CITATIONS', 'TECTONIC SETTING', 'LOCATION', 'LOCATION COMMENT', 'LATITUDE MIN',
+    'LATITUDE MAX', 'LONGITUDE MIN', 'LONGITUDE MAX', 'LAND OR SEA', 'ELEVATION MIN',
+    'ELEVATION_(MAX.)', 'SAMPLE NAME', 'ROCK NAME', 'MIN. AGE (YRS.)', 'MAX. AGE (YRS.)',
+    'ROCK TYPE', 'MATERIAL', 'UNIQUE_ID',
+]
+CONVERTERS = """from pygeoroc.errata import CONVERTERS
+
+FIELDS = {
+    'LAND_OR_SEA': CONVERTERS.upper,
+}
+
+COORDINATES = {
+    '%s': {
+        'latitude': CONVERTERS.negative,
+        'longitude': CONVERTERS.positive,
+    }
+}
+"""
+
+
+def quote(s):
+    return '"{}"'.format(s.replace('"', '""'))
+
+
+def measurement_columns(n):
+    units = ['(WT%)', '(PPM)', '(PPB)']
+    cols = []
+    for i in range(n):
+        if i % 10 == 9:
+            cols.append('X{}_X{}'.format(i, i + 1))  # An isotope ratio.
+        else:
+            cols.append('E{}{}'.format(i, units[i % len(units)]))
+    return cols
+
+
+def sample_rows(rng, fileno, rows, mcols, refs, density, duplicates):
+    for i in range(rows):
+        cits = rng.sample(refs, 2)
+        sid = i if rng.random() < duplicates else '{}-{}'.format(fileno, i)
+        row = {
+            'CITATIONS': ' '.join('[{}]'.format(c) for c in cits),
+            'TECTONIC SETTING': 'ARCHEAN CRATON',
+            'LOCATION': 'REGION {} / SITE {} / PLACE ÏÖ'.format(fileno, i % 7),
+            'LOCATION COMMENT': '',
+            'LATITUDE MIN': '{:.4f}'.format(rng.uniform(-90, 90)),
+            'LONGITUDE MIN': '{:.4f}'.format(rng.uniform(-180, 180)),
+            'LAND OR SEA': rng.choice(['sae', 'SAQ']),
+            'SAMPLE NAME': 'S-{} [{}]'.format(i, cits[0]),
+            'ROCK NAME': 'BASALT',
+            'MIN. AGE (YRS.)': '3480000000  / 3484000000',
+            'UNIQUE_ID': str(sid),
+        }
+        row['LATITUDE MAX'], row['LONGITUDE MAX'] = row['LATITUDE MIN'], row['LONGITUDE MIN']
+        for col in mcols:
+            if rng.random() < density:
+                value = '{:.3f}'.format(rng.uniform(0, 100))
+                if rng.random() < 0.1:
+                    value += ' [{}]'.format(cits[1])
+                row[col] = value
+        yield row
+
+
+def create(outdir, files=3, rows=1000, columns=300, density=0.15, duplicates=0.1, seed=1):
+    """
+    :param columns: Number of measurement columns (in addition to 18 metadata columns).
+    :param density: Share of non-empty measurement values.
+    :param duplicates: Share of samples with an ID shared across files.
+    """
+    rng = random.Random(seed)
+    outdir = pathlib.Path(outdir)
+    outdir.joinpath('csv').mkdir(parents=True, exist_ok=True)
+    mcols = measurement_columns(columns)
+    header = META_COLS + mcols
+    mds = []
+    for fileno in range(files):
+        name = 'SYNTHETIC_{}.csv'.format(fileno)
+        refs = list(range(fileno * 100 + 1, fileno * 100 + 51))
+        lines = [','.join(quote(c) for c in header)]
+        for row in sample_rows(rng, fileno, rows, mcols, refs, density, duplicates):
+            lines.append(','.join(quote(row.get(c, '')) for c in header))
+        lines.append('Abbreviations: VOL: VOLCANIC ROCK; WR: WHOLE ROCK; SAE: SUBAERIAL;')
+        lines.append('References:')
+        for ref in refs:
+            lines.append(
+                '"[{0}] AUTHOR A., AUTHOR B.:    TITLE {0}  J. PETROL. 1   [2000] 1-2"'.format(ref))
+        data = '\r'.join(lines).encode('cp1252')
+        outdir.joinpath('csv', name).write_bytes(data)
+        mds.append(dict(dataFile=dict(
+            filename=name,
+            creationDate='2022-06-20',
+            md5=hashlib.md5(data).hexdigest(),
+            filesize=len(data),
+            persistentId='doi:10.0/SYNTH/{}'.format(fileno),
+            pidURL='https://doi.org/10.0/SYNTH/{}'.format(fileno))))
+
+    outdir.joinpath('datasets.json').write_text(json.dumps([dict(
+        protocol='doi',
+        authority='10.0',
+        identifier='SYNTH',
+        persistentUrl='https://doi.org/10.0/SYNTH',
+        publisher='none',
+        latestVersion=dict(
+            versionNumber=1,
+            metadataBlocks=dict(citation=dict(fields=[
+                dict(typeName='title', value='Synthetic Compilation'),
+                dict(typeName='author', value=[dict(authorName=dict(value='Anonymous'))]),
+                dict(typeName='dateOfDeposit', value='2022-06-20'),
+            ])),
+            files=mds))], indent=4))
+    outdir.joinpath('converters.py').write_text(CONVERTERS % 'SYNTHETIC_0.csv')
+    return outdir
+
+
+def register(parser):
+    parser.add_argument('--files', type=int, default=3, help='Number of CSV files')
+    parser.add_argument('--rows', type=int, default=1000, help='Number of samples per file')
+    parser.add_argument('--columns', type=int, default=300, help='Number of measurement columns')
+    parser.add_argument('--density', type=float, default=0.15, help='Share of non-empty values')
+    parser.add_argument(
+        '--duplicates', type=float, default=0.1, help='Share of samples in multiple files')
+    parser.add_argument('--seed', type=int, default=1)
+
+
+def params(args):
+    return {k: getattr(args, k) for k in ['files', 'rows', 'columns', 'density', 'duplicates']}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('outdir')
+    register(parser)
+    args = parser.parse_args()
+    print(create(args.outdir, seed=args.seed, **params(args)))
@@ -29,13 +29,16 @@ setup(
     install_requires=[
         'attrs>=19.3',
         'clldutils>=3.5',
-        'csvw',
         'requests',
         'tqdm',
     ],
     extras_require={
         'dev': ['flake8', 'wheel', 'twine'],
+        'columnar': ['numpy'],
+        'arrow': ['pyarrow'],
         'test': [
+            'numpy',
+            'pyarrow',
             'pytest>=4.3',
             'pytest-mock',
             'requests-mock',
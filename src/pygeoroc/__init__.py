@@ -1,5 +1,3 @@
-from pygeoroc.api import GEOROC  # noqa: F401
-
 __version__ = '2.0.1.dev0'
 DATASETS = {
     "doi:10.25625/JUQK7N": "GEOROC Compilation: Seamounts",
@@ -13,3 +11,13 @@ DATASETS = {
     "doi:10.25625/RZZ9VM": "GEOROC Compilation: Intraplate Volcanic Rocks",
     "doi:10.25625/AVLFC2": "GEOROC Compilation: Ocean Basin Flood Basalts",
 }
+
+
+def __getattr__(name):
+    # `GEOROC` is imported lazily (see PEP 562), so that importing `pygeoroc` - e.g. to run the
+    # `georoc` command - does not pull in `pygeoroc.api` and its dependencies.
+    if name == 'GEOROC':
+        from pygeoroc.api import GEOROC
+
+        return GEOROC
+    raise AttributeError("module 'pygeoroc' has no attribute '{}'".format(name))
@@ -1,12 +1,32 @@
 import sys
+import json
+import pstats
 import pathlib
+import cProfile
 import contextlib
 
 from clldutils.clilib import get_parser_and_subparsers, register_subcommands, PathType
 from clldutils.loglib import Logging
 
 import pygeoroc.commands
-from pygeoroc import GEOROC
+from pygeoroc import timing
+
+
+def report_timings(timings, args):
+    timings.report(args.log)
+    if args.timings_json:
+        res = json.dumps(timings.as_json(), indent=4)
+        if args.timings_json == '-':
+            print(res)
+        else:
+            pathlib.Path(args.timings_json).write_text(res, encoding='utf8')
+
+
+def report_profile(profile, args):
+    if args.profile_out:
+        profile.dump_stats(args.profile_out)
+    else:
+        pstats.Stats(profile, stream=sys.stderr).sort_stats('cumulative').print_stats(30)
 
 
 def main(args=None, catch_all=False, parsed_args=None, log=None):
@@ -16,6 +36,47 @@ def main(args=None, catch_all=False, parsed_args=None, log=None):
         type=PathType(type='dir'),
         default=pathlib.Path('.'),
         help='Location of the data repository')
+    parser.add_argument(
+        '--cache',
+        action='store_true',
+        default=False,
+        help='Cache parsed samples and references in <repos>/cache, to speed up repeated runs')
+    parser.add_argument(
+        '--cache-dir',
+        metavar='DIR',
+        type=pathlib.Path,
+        default=None,
+        help='Directory to use for the cache; implies --cache')
+    parser.add_argument(
+        '--archives',
+        action='store_true',
+        default=None,
+        help='Store datasets as zip archives in <repos>/archives, reading CSV files from the '
+             'archives rather than extracting them (used by default if <repos>/archives exists)')
+    parser.add_argument(
+        '--timings',
+        action='store_true',
+        default=False,
+        help='Log the time spent in the stages of reading and loading data, i.e. decoding, '
+             'CSV parsing, sample construction, errata and SQLite inserts')
+    parser.add_argument(
+        '--timings-json',
+        metavar='PATH',
+        default=None,
+        help="Write per-stage and per-file timings, row counts and rows per second as JSON to "
+             "PATH ('-' for stdout); implies --timings")
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        default=False,
+        help='Run the command with cProfile, printing the top functions by cumulative time to '
+             'stderr')
+    parser.add_argument(
+        '--profile-out',
+        metavar='PATH',
+        default=None,
+        help='Dump the cProfile stats to PATH, e.g. for inspection with snakeviz; '
+             'implies --profile')
     register_subcommands(subparsers, pygeoroc.commands)
 
     args = parsed_args or parser.parse_args(args=args)
@@ -29,8 +90,20 @@ def main(args=None, catch_all=False, parsed_args=None, log=None):
             stack.enter_context(Logging(args.log, level=args.log_level))
         else:
             args.log = log
-        args.repos = GEOROC(args.repos)
+        # Imported here, to keep `georoc -h` fast:
+        from pygeoroc.api import GEOROC
+
+        args.repos = GEOROC(
+            args.repos,
+            cache=getattr(args, 'cache_dir', None) or getattr(args, 'cache', False),
+            archives=getattr(args, 'archives', None))
+        timings = timing.enable() \
+            if getattr(args, 'timings', False) or getattr(args, 'timings_json', None) else None
+        profile = cProfile.Profile() \
+            if getattr(args, 'profile', False) or getattr(args, 'profile_out', None) else None
         try:
+            if profile:
+                profile.enable()
             return args.main(args) or 0
         except KeyboardInterrupt:  # pragma: no cover
             return 0
@@ -39,6 +112,13 @@ def main(args=None, catch_all=False, parsed_args=None, log=None):
                 print(e)
                 return 1
             raise
+        finally:
+            if profile:
+                profile.disable()
+                report_profile(profile, args)
+            if timings:
+                timing.disable()
+                report_timings(timings, args)
 
 
 if __name__ == '__main__':  # pragma: no cover
@@ -1,22 +1,37 @@
 import io
 import re
+import csv
+import mmap
+import shutil
 import typing
+import hashlib
+import operator
+import functools
 import pathlib
 import sqlite3
-import zipfile
 import argparse
+import threading
 import itertools
 import contextlib
 import collections
+import collections.abc
+import concurrent.futures
 
-import requests
 from clldutils.apilib import API
 from clldutils.misc import lazyproperty
 from clldutils.path import md5
-from clldutils.jsonlib import update, dump
-from csvw import dsv
+from clldutils.jsonlib import dump, load
 import attr
 
+from pygeoroc import timing
+
+if typing.TYPE_CHECKING:  # pragma: no cover
+    import numpy
+    # `requests` and `zipfile` are only imported when needed, to keep startup of the `georoc`
+    # command fast.
+    import zipfile
+    import requests
+
 # DIGIS Dataverse API:
 API_URL = "https://data.goettingen-research-online.de/api/"
 
@@ -29,21 +44,190 @@ COL_MAP = {
     'LONGITUDE_(MAX.)': 'LONGITUDE_MAX',
     'LONGITUDE_(MIN.)': 'LONGITUDE_MIN',
 }
+# Size of the chunks in which downloads are written to disk:
+CHUNK_SIZE = 1024 * 1024
+# If at most this share of the files of a dataset is missing, files are downloaded individually,
+# rather than as zip archive of the whole dataset:
+MAX_SHARE_SINGLE_FILES = 0.5
 CITATION_PATTERN = re.compile(r'\[(?P<ref>[0-9]+)]')
+# Columns in the CSV files which are not stored in `Sample.data`:
+SAMPLE_COLS = ['UNIQUE_ID', 'SAMPLE_NAME', 'CITATIONS']
+REFERENCE_PATTERN = re.compile(r'\[(?P<id>[0-9]+)]\s+(?P<ref>.+)')
+
 
+def api_call(
+        p, session: typing.Optional['requests.Session'] = None, **kw) -> 'requests.Response':
+    """
+    :param session: A `requests.Session` to reuse connections across calls.
+    :param kw: Keyword arguments passed into `requests.get`, e.g. `stream=True`.
+    """
+    import requests
 
-def api_call(p):
     assert not p.startswith('/')
-    return requests.get('{}{}'.format(API_URL, p))
+    return (session or requests).get('{}{}'.format(API_URL, p), **kw)
+
+
+def stream_to_file(r: 'requests.Response', p: pathlib.Path, mode='wb'):
+    r.raise_for_status()
+    with p.open(mode) as fp:
+        for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+            fp.write(chunk)
+
+
+def parse_reference(line: str) -> typing.Optional[typing.Tuple[int, str]]:
+    """
+    Parse a line from the list of references in the trailer of a CSV file.
+
+    :return: Pair `(id, reference)` - or `None`, if the line is not a reference.
+    """
+    line = line.strip()
+    if line.startswith('"'):
+        line = line[1:].strip()
+    if line.endswith('"'):
+        line = line[:-1].strip()
+    m = REFERENCE_PATTERN.match(line)
+    if m:
+        return int(m.group('id')), m.group('ref')
+
+
+def _find_line(mm, prefix: bytes, start: int = 0) -> int:
+    """
+    Find the first line starting with `prefix` (ignoring leading blanks) in a bytes-like object.
+
+    Note: Searching for the prefix with `find` is a lot faster than searching with a regex \
+    anchored at line starts.
+
+    :return: Offset of the prefix - or -1.
+    """
+    while True:
+        i = mm.find(prefix, start)
+        if i == -1:
+            return i
+        j = i
+        while j > 0 and mm[j - 1:j] in (b' ', b'\t'):
+            j -= 1
+        if j == 0 or mm[j - 1:j] in (b'\r', b'\n'):
+            return i
+        start = i + 1
+
+
+def _count_lines(lines: typing.Iterable[str]) -> typing.Tuple[int, int]:
+    samples, references, in_refs = -1, 0, None
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        if in_refs is None:
+            if line.startswith('Abbreviations') or line.startswith('References:'):
+                in_refs = line.startswith('References:')
+            else:
+                samples += 1
+        elif in_refs:
+            if parse_reference(line):
+                references += 1
+        elif line.startswith('References:'):
+            in_refs = True
+    # The header row is not a sample:
+    return max(samples, 0), references
+
+
+def _count_rows(mm, end: int) -> int:
+    """
+    Count the non-blank lines in `mm[:end]`, searching for line ends in place - i.e. without
+    copying the (possibly huge) sample section of a file.
+
+    Note: Lines are assumed to be terminated consistently, i.e. by the line end found first.
+    """
+    ends = [i for i in [mm.find(b'\r', 0, end), mm.find(b'\n', 0, end)] if i != -1]
+    if not ends:
+        return 1 if mm[:end].strip() else 0
+    i = min(ends)
+    eol = b'\r\n' if mm[i:i + 2] == b'\r\n' else mm[i:i + 1]
+    n, start = 0, 0
+    while start < end:
+        j = mm.find(eol, start, end)
+        if j == -1:
+            j = end
+        # Only lines starting with whitespace must be copied to check whether they are blank:
+        if j > start and (mm[start] not in b' \t\r\n' or mm[start:j].strip()):
+            n += 1
+        start = j + len(eol)
+    return n
+
+
+def scan_counts(path: pathlib.Path, member: typing.Optional[str] = None) -> typing.Tuple[int, int]:
+    """
+    Count samples and references in a CSV file, scanning the raw bytes of the file rather than
+    parsing rows.
+
+    Note: As for `FileReader`, rows are assumed not to contain line breaks, and samples are \
+    counted including duplicates.
+
+    :param member: Name of the CSV file in the zip archive `path` - see `File.location`. \
+    Compressed members cannot be memory-mapped, so their lines are decoded and counted.
+    :return: Pair `(number of samples, number of references)`.
+    """
+    if member is not None:
+        import zipfile
+
+        with zipfile.ZipFile(str(path)) as z:
+            with z.open(member) as fp:
+                return _count_lines(io.TextIOWrapper(fp, encoding='cp1252'))
+    if not path.stat().st_size:
+        return 0, 0
+    with path.open('rb') as fp:
+        with contextlib.closing(mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)) as mm:
+            end = min(
+                (i for i in [_find_line(mm, b'Abbreviations'), _find_line(mm, b'References:')]
+                 if i != -1),
+                default=len(mm))
+            # The header row is not a sample:
+            samples = max(_count_rows(mm, end) - 1, 0)
+            references = 0
+            start = _find_line(mm, b'References:', end) if end < len(mm) else -1
+            if start != -1:
+                # Skip the "References:" line:
+                for line in mm[start:].splitlines()[1:]:
+                    if parse_reference(line.decode('cp1252')):
+                        references += 1
+            return samples, references
+
+
+def _scan(path: pathlib.Path, member: typing.Optional[str] = None, checksum: bool = True):
+    """
+    Worker function for `Counts.update`.
+
+    :return: Pair `(md5 checksum or None, counts)` - or `(None, None)` if the archive `path` has \
+    no member `member`.
+    """
+    try:
+        if member is None:
+            res = md5(path) if checksum else None
+        else:
+            import zipfile
+
+            with zipfile.ZipFile(str(path)) as z:
+                res = member_md5(z, member) if checksum else None
+        return res, scan_counts(path, member)
+    except KeyError:
+        return None, None
 
 
 class File:
     """
     Represents one file in a dataset from dataverse.
     """
-    def __init__(self, md: dict, section: typing.Optional[str] = None):
+    def __init__(
+            self,
+            md: dict,
+            section: typing.Optional[str] = None,
+            archive: typing.Optional[str] = None):
+        """
+        :param archive: Name of the zip archive of the dataset containing the file.
+        """
         self.md = md
         self.section = section
+        self.archive = archive
         self.name = self.md['filename']
         assert self.name == self.name.strip()
         self.path = pathlib.Path(self.name)
@@ -52,47 +236,297 @@ class File:
         self.size = self.md['filesize']
         self.id = self.md['persistentId']
 
+    def location(self, repos: 'GEOROC') -> typing.Tuple[pathlib.Path, typing.Optional[str]]:
+        """
+        Where the file is stored in the repository.
+
+        :return: Pair `(path of the CSV file, None)` - or, if `repos` stores datasets as zip \
+        archives, `(path of the archive, name of the archive member)`.
+        """
+        if repos.archives:
+            return repos.archivedir / self.archive, self.name
+        return repos.csvdir / self.name, None
+
+    @contextlib.contextmanager
+    def open(self, repos: 'GEOROC') -> typing.Generator[typing.BinaryIO, None, None]:
+        """
+        Open the file for reading bytes - streaming archive members without extracting them.
+        """
+        p, member = self.location(repos)
+        if member is None:
+            with p.open('rb') as fp:
+                yield fp
+        else:
+            import zipfile
+
+            with zipfile.ZipFile(str(p)) as z:
+                with z.open(member) as fp:
+                    yield fp
+
     def exists(self, repos: 'GEOROC') -> bool:
         """
-        Checks whether the specified file exists with correct checksum in the repository.
+        Checks whether the specified file exists with correct checksum in the repository (or in
+        the zip archive of its dataset).
+        """
+        p, member = self.location(repos)
+        try:
+            return p.exists() and repos.checksums.md5(p, member=member) == self.md5
+        except KeyError:  # The archive has no such member.
+            return False
+
+    def partpath(self, repos: 'GEOROC') -> pathlib.Path:
+        """
+        Path of the file while it is being downloaded.
         """
-        p = repos.csvdir / self.name
-        return p.exists() and md5(p) == self.md5
+        return repos.csvdir / '{}.part'.format(self.name)
+
+    def verify(self, repos: 'GEOROC', part: pathlib.Path):
+        """
+        Move a downloaded file into place, after checking its checksum.
+        """
+        if md5(part) != self.md5:
+            part.unlink()
+            raise ValueError('Checksum mismatch for downloaded file {}'.format(self.name))
+        part.replace(repos.csvdir / self.name)
+        repos.checksums.add(repos.csvdir / self.name, self.md5)
+
+    def download(self, repos: 'GEOROC', log=None, session=None):
+        """
+        Download the file, resuming an interrupted download if possible.
+        """
+        if log:
+            log.info('Downloading file {}'.format(self.name))
+        part, headers = self.partpath(repos), {}
+        if part.exists():
+            headers['Range'] = 'bytes={}-'.format(part.stat().st_size)
+        r = api_call(
+            'access/datafile/:persistentId/?persistentId={}&format=original'.format(self.id),
+            session=session,
+            headers=headers,
+            stream=True)
+        if r.status_code == 416:
+            # "Range Not Satisfiable": The part file is complete already - e.g. if the download was
+            # interrupted before verifying it - so we verify it as it is. If it is corrupt, it is
+            # deleted, and the next download starts from scratch.
+            r.close()
+        else:
+            # If the server does not support range requests, we start from scratch:
+            stream_to_file(r, part, mode='ab' if r.status_code == 206 else 'wb')
+        self.verify(repos, part)
 
     def iter_lines(self, repos: 'GEOROC') -> typing.Generator[str, None, None]:
-        for line in repos.csvdir.joinpath(self.name).open(encoding='cp1252'):
-            if line.strip():
-                yield line.strip()
+        # Decoding is incremental, i.e. files are never read into memory as a whole:
+        with self.open(repos) as fp, io.TextIOWrapper(fp, encoding='cp1252') as lines:
+            for line in lines:
+                if line.strip():
+                    yield line.strip()
+
+    def reader(self, repos: 'GEOROC') -> 'FileReader':
+        """
+        A reader providing access to samples and references, reading the file only once - or
+        reading the parse cache, if enabled for `repos`.
+        """
+        if repos.cache:
+            return repos.cache.reader(self)
+        return FileReader(self, repos)
+
+    def columns(self, repos: 'GEOROC') -> typing.List[str]:
+        """
+        The keys of `Sample.data` for samples in this file, as determined from the header line.
+
+        The result is cached (per API instance) keyed by the file's checksum.
+        """
+        if self.md5 not in repos.columns_cache:
+            header = next(csv.reader(itertools.islice(self.iter_lines(repos), 1)), [])
+            repos.columns_cache[self.md5] = [
+                column_name(k) for k in header if k and column_name(k) not in SAMPLE_COLS]
+        return repos.columns_cache[self.md5]
 
-    def iter_samples(self, repos: 'GEOROC', stdout=False) -> typing.Generator['Sample', None, None]:
+    def iter_samples(
+            self, repos: 'GEOROC', stdout=False, columns=None, where=None, seen=None,
+    ) -> typing.Generator['Sample', None, None]:
+        """
+        See `FileReader.iter_samples`.
+        """
+        yield from self.reader(repos).iter_samples(
+            stdout=stdout, columns=columns, where=where, seen=seen)
+
+    def read_columns(self, repos: 'GEOROC') -> typing.Dict[str, 'numpy.ndarray']:
+        """
+        Read the samples in the file into one `numpy.ndarray` per column.
+
+        Requires `numpy` to be installed.
+
+        :return: `dict` mapping `UNIQUE_ID`, `SAMPLE_NAME` and the keys of `Sample.data` to \
+        arrays. Columns typed as `float` by `col_type` are read into `float64` arrays with `NaN` \
+        for missing values, all other columns into `object` arrays with `None` for missing \
+        values. Citation markers are removed, errata are fixed.
+        """
+        import numpy
         from pygeoroc import errata
-        lines = itertools.takewhile(
-            lambda l: not (l.startswith('Abbreviations') or l.startswith('References:')),
-            self.iter_lines(repos))
-        for i, row in enumerate(dsv.reader(lines, dicts=True), start=2):
-            try:
-                sample = Sample.from_row(row)
-            except:  # pragma: no cover # noqa: E722
-                print('{}:{}'.format(self.name, i))
-                raise
-            errata.fix(sample, self, repos, stdout=stdout)
-            yield sample
+
+        # The parse cache stores samples, not raw rows, so we always read the CSV file:
+        rows = FileReader(self, repos).iter_rows()
+        keys = [column_name(k) for k in next(rows, [])]
+        cols = list(zip(*rows)) or [() for _ in keys]
+
+        res = collections.OrderedDict()
+        for k, cells in zip(keys, cols):
+            if k == 'CITATIONS':
+                continue
+            if k in SAMPLE_COLS:
+                res[k] = numpy.array(cells, dtype=object)
+                continue
+            # Remove citation markers from all cells of the column at once:
+            cells = '\0'.join(cells)
+            if '[' in cells:
+                cells = CITATION_PATTERN.sub('', cells)
+            a = numpy.char.strip(numpy.array(cells.split('\0'), dtype=str))
+            empty = a == ''
+            if col_type(k) is float:
+                res[k] = numpy.where(empty, 'nan', a).astype(numpy.float64)
+            else:
+                res[k] = numpy.where(empty, None, a.astype(object))
+        return errata.fix_columns(res, self, repos)
 
     def iter_references(
             self, repos: 'GEOROC') -> typing.Generator[typing.Tuple[int, str], None, None]:
-        in_refs = False
-        for line in self.iter_lines(repos):
-            if in_refs:
-                if line.startswith('"'):
-                    line = line[1:].strip()
-                if line.endswith('"'):
-                    line = line[:-1].strip()
-                m = re.match(r'\[(?P<id>[0-9]+)]\s+(?P<ref>.+)', line)
-                if m:
-                    yield int(m.group('id')), m.group('ref')
+        yield from self.reader(repos).references
+
+    def count_samples(self, repos: 'GEOROC') -> int:
+        """
+        The number of samples in the file - including duplicates - as determined by
+        `scan_counts`, and cached in `repos.counts`.
+        """
+        return repos.counts.get(self, repos)[0]
+
+    def count_references(self, repos: 'GEOROC') -> int:
+        """
+        The number of references in the file - see `count_samples`.
+        """
+        return repos.counts.get(self, repos)[1]
+
+
+class FileReader:
+    """
+    Reads a GEOROC CSV file in one pass.
+
+    GEOROC CSV files list the samples first, followed by a trailer containing abbreviations and
+    references. Thus, samples must be read before references. Accessing `references` before all
+    samples have been read skips the remaining sample rows without parsing them.
+    """
+    def __init__(self, f: File, repos: 'GEOROC'):
+        self.file = f
+        self.repos = repos
+        self._lines = timing.timed('decode', f.iter_lines(repos))
+        self._in_refs = False
+        self._references = None
+
+    def _iter_sample_lines(self) -> typing.Generator[str, None, None]:
+        for line in self._lines:
+            if line.startswith('Abbreviations') or line.startswith('References:'):
+                self._in_refs = line.startswith('References:')
+                return
+            yield line
+
+    def iter_rows(self) -> typing.Generator[typing.List[str], None, None]:
+        """
+        Iterate over the rows of the sample table - including the header row.
+        """
+        # Note: We use `csv.reader` directly, because `csvw.dsv.reader` would read all lines into
+        # memory first, and inspect each cell for newlines.
+        yield from timing.timed('csv', csv.reader(self._iter_sample_lines()))
+
+    def iter_samples(
+            self,
+            stdout=False,
+            columns: typing.Optional[typing.Iterable[str]] = None,
+            where=None,
+            seen: typing.Optional['SeenSet'] = None,
+    ) -> typing.Generator['Sample', None, None]:
+        """
+        :param columns: Names of the columns to read into `Sample.data` - or `None` for all \
+        columns. Unselected cells are not converted, and not fixed.
+        :param where: Row filter, see `where_predicate`. Evaluated on the (converted and fixed) \
+        data of a sample before the `Sample` is built. Columns referenced in a `dict` filter \
+        are read in addition to `columns`.
+        :param seen: IDs of samples to skip. IDs of samples read from the file - whether they \
+        pass the filter or not - are added, i.e. the first occurrence of a sample wins.
+        """
+        from pygeoroc import errata
+
+        rows = self.iter_rows()
+        keys = [column_name(k) for k in next(rows, [])]
+        if not keys:
+            return  # pragma: no cover
+        id_, name, citations = [keys.index(k) for k in SAMPLE_COLS]
+        positions = [i for i, k in enumerate(keys) if k not in SAMPLE_COLS]
+        if columns is not None:
+            selected = set(columns).union(where if isinstance(where, dict) else [])
+            positions = [i for i in positions if keys[i] in selected]
+        # All samples from the file share the same header:
+        header = Columns(keys[i] for i in positions)
+        plan = errata.Plan.compile(self.file, self.repos, header.names)
+        predicate = where_predicate(where)
+
+        def build():
+            for i, row in enumerate(rows, start=2):
+                try:
+                    sample = Sample(
+                        id=row[id_],
+                        name=row[name],
+                        citations=row[citations],
+                        data=SampleData(header, [row[j] for j in positions]))
+                except:  # pragma: no cover # noqa: E722
+                    print('{}:{}'.format(self.file.name, i))
+                    raise
+                yield sample
+
+        def build_filtered():
+            for row in rows:
+                if seen is not None and not seen.add(row[id_]):
+                    continue
+                cits = citations_converter(row[citations])
+                data = SampleData(header, [row[j] for j in positions])
+                convert_cells(data, cits)
+                if plan:
+                    plan.apply(data)
+                if predicate is None or predicate(data):
+                    yield Sample.from_parsed(row[id_], row[name], cits, data)
 
-            if line.startswith('References:'):
-                in_refs = True
+        def fix(samples):
+            for sample in samples:
+                plan.apply(sample.data)
+                yield sample
+
+        # Time is attributed to the file by the outermost stage:
+        if predicate or seen is not None:
+            samples = timing.timed('sample', build_filtered(), file=self.file.name)
+        else:
+            samples = timing.timed('sample', build(), file=None if plan else self.file.name)
+            if plan:
+                samples = timing.timed('errata', fix(samples), file=self.file.name)
+        try:
+            yield from samples
+        finally:
+            plan.report(stdout=stdout)
+
+    @property
+    def references(self) -> typing.List[typing.Tuple[int, str]]:
+        if self._references is None:
+            if not self._in_refs:
+                # Skip the remaining samples (or abbreviations):
+                for _ in self._iter_sample_lines():
+                    pass
+            self._references = []
+            for line in self._lines:
+                if self._in_refs:
+                    ref = parse_reference(line)
+                    if ref:
+                        self._references.append(ref)
+                if line.startswith('References:'):
+                    self._in_refs = True
+        return self._references
 
 
 class Dataset:
@@ -106,8 +540,19 @@ class Dataset:
         self.name = self._citation_data['title']
 
     @classmethod
-    def from_doi(cls, doi: str) -> 'Dataset':
-        return cls(api_call('datasets/:persistentId/?persistentId=' + doi).json()['data'])
+    def from_doi(
+            cls, doi: str, session: typing.Optional['requests.Session'] = None) -> 'Dataset':
+        """
+        Fetch the metadata of a dataset - a synchronous wrapper for
+        `pygeoroc.dataverse.Client.dataset`, i.e. retrying failed requests.
+        """
+        from pygeoroc.dataverse import Client, run_sync
+
+        async def fetch():
+            async with Client(session=session, concurrency=1) as client:
+                return await client.dataset(doi)
+
+        return run_sync(fetch())
 
     @property
     def citation(self) -> str:
@@ -119,33 +564,302 @@ class Dataset:
         res += 'V{}'.format(self.md['latestVersion']['versionNumber'])
         return res
 
-    @property
+    @lazyproperty
     def files(self) -> typing.List[File]:
-        return [File(r['dataFile'], section=self.name) for r in self.md['latestVersion']['files']]
+        return [
+            File(r['dataFile'], section=self.name, archive=self.archive)
+            for r in self.md['latestVersion']['files']]
+
+    @property
+    def archive(self) -> str:
+        """
+        Name of the zip archive of the dataset, as stored in `GEOROC.archivedir`.
+        """
+        return '{}.zip'.format(self.md['identifier'])
+
+    def download_files(self, repos: 'GEOROC', log=None, session=None):
+        """
+        Download files which are missing or outdated in the repository.
+
+        If only a few files are affected, these are downloaded individually (see `File.download`),
+        otherwise the zip archive of the whole dataset is streamed to disk and the files are
+        extracted from it. If `repos` stores datasets as zip archives, the archive is downloaded
+        (see `download_archive`).
+        """
+        import zipfile
 
-    def download_files(self, repos: 'GEOROC', log=None):
         # Check, whether we have to download any files:
-        missing = {f.name for f in self.files if not f.exists(repos)}
-        print(missing)
-        if missing:
+        if not repos.archives:
+            repos.checksums.update(repos.csvdir / f.name for f in self.files)
+        missing = {f.name: f for f in self.files if not f.exists(repos)}
+        if not missing:
             if log:
-                log.info('Downloading files for dataset "{}" ...'.format(self.name))
-            r = api_call('access/dataset/:persistentId/?persistentId={}'.format(self.doi))
-            z = zipfile.ZipFile(io.BytesIO(r.content))
+                log.info(
+                    'Skipping download for dataset "{}". All files up-to-date.'.format(self.name))
+            return
+
+        if repos.archives:
+            self.download_archive(repos, log=log, session=session)
+            return
+
+        if len(missing) <= MAX_SHARE_SINGLE_FILES * len(self.files):
+            for f in missing.values():
+                f.download(repos, log=log, session=session)
+            return
+
+        if log:
+            log.info('Downloading files for dataset "{}" ...'.format(self.name))
+        zp = repos.path('{}.zip'.format(self.md['identifier']))
+        try:
+            stream_to_file(
+                api_call(
+                    'access/dataset/:persistentId/?persistentId={}'.format(self.doi),
+                    session=session,
+                    stream=True),
+                zp)
             if log:
                 log.info('... done')
-            for name in z.namelist():
-                assert name == name.strip()
-                if name in missing:
-                    if log:
-                        log.info('Updating file {}'.format(name))
-                    repos.csvdir.joinpath(name).write_bytes(z.read(name))
-        else:
+            with zipfile.ZipFile(str(zp)) as z:
+                for name in z.namelist():
+                    assert name == name.strip()
+                    if name in missing:
+                        if log:
+                            log.info('Updating file {}'.format(name))
+                        part = missing[name].partpath(repos)
+                        with z.open(name) as fin, part.open('wb') as fout:
+                            shutil.copyfileobj(fin, fout, CHUNK_SIZE)
+                        missing[name].verify(repos, part)
+        finally:
+            if zp.exists():
+                zp.unlink()
+
+    def download_archive(self, repos: 'GEOROC', log=None, session=None):
+        """
+        Download the zip archive of the dataset to `repos.archivedir`, replacing an existing
+        archive after checking that it contains all files of the dataset with correct checksums.
+
+        :raises ValueError: if a file is missing in the archive or has a wrong checksum.
+
+        Note: Since members of a zip archive cannot be replaced, the whole archive is downloaded \
+        even if only some files are outdated.
+        """
+        import zipfile
+
+        if log:
+            log.info('Downloading archive for dataset "{}" ...'.format(self.name))
+        zp = repos.archivedir / self.archive
+        part = zp.parent / '{}.part'.format(zp.name)
+        zp.parent.mkdir(exist_ok=True)
+        try:
+            stream_to_file(
+                api_call(
+                    'access/dataset/:persistentId/?persistentId={}'.format(self.doi),
+                    session=session,
+                    stream=True),
+                part)
+            checksums = {}
+            with zipfile.ZipFile(str(part)) as z:
+                names = set(z.namelist())
+                for f in self.files:
+                    if f.name not in names:
+                        raise ValueError('File {} missing in downloaded archive'.format(f.name))
+                    checksums[f.name] = member_md5(z, f.name)
+                    if checksums[f.name] != f.md5:
+                        raise ValueError(
+                            'Checksum mismatch for downloaded file {}'.format(f.name))
+            part.replace(zp)
+            for name, checksum in checksums.items():
+                repos.checksums.add(zp, checksum, member=name)
             if log:
-                log.info(
-                    'Skipping download for dataset "{}". All files up-to-date.'.format(self.name))
+                log.info('... done')
+        finally:
+            if part.exists():
+                part.unlink()
 
 
+def member_md5(z: 'zipfile.ZipFile', name: str) -> str:
+    """
+    Compute the checksum of a member of a zip archive, without extracting it.
+
+    :raises KeyError: if the archive has no member `name`.
+    """
+    res = hashlib.md5()
+    with z.open(name) as fp:
+        for chunk in iter(functools.partial(fp.read, CHUNK_SIZE), b''):
+            res.update(chunk)
+    return res.hexdigest()
+
+
+class Checksums:
+    """
+    A persistent cache of md5 checksums of files, keyed by path, size and modification time.
+
+    Entries are invalidated when size or modification time of a file change. Checksums of
+    members of zip archives are keyed by `<path of the archive>!<name of the member>`, and
+    invalidated when the archive changes.
+    """
+    def __init__(self, path: pathlib.Path):
+        self.path = path
+        self._data = load(path) if path.exists() else {}
+        self._lock = threading.Lock()
+
+    def _key(self, p: pathlib.Path, member: typing.Optional[str] = None) -> str:
+        try:
+            res = p.resolve().relative_to(self.path.parent.resolve()).as_posix()
+        except ValueError:  # pragma: no cover
+            res = str(p.resolve())
+        return res if member is None else '{}!{}'.format(res, member)
+
+    def md5(self, p: pathlib.Path, member: typing.Optional[str] = None) -> str:
+        """
+        Compute the checksum of a file - or of a member of the zip archive `p` - unless a valid
+        checksum is cached.
+
+        :raises KeyError: if the archive has no member `member`.
+        """
+        res = self.cached(p, member=member)
+        if res:
+            return res
+        if member is None:
+            return self.add(p, md5(p))
+        import zipfile
+
+        with zipfile.ZipFile(str(p)) as z:
+            return self.add(p, member_md5(z, member), member=member)
+
+    def cached(self, p: pathlib.Path, member: typing.Optional[str] = None) -> typing.Optional[str]:
+        """
+        :return: The cached checksum of a file - or `None` if no valid checksum is cached.
+        """
+        entry, st = self._data.get(self._key(p, member)), p.stat()
+        if entry and entry['size'] == st.st_size and entry['mtime'] == st.st_mtime_ns:
+            return entry['md5']
+
+    def add(self, p: pathlib.Path, checksum: str, member: typing.Optional[str] = None) -> str:
+        st = p.stat()
+        with self._lock:
+            self._data[self._key(p, member)] = dict(
+                md5=checksum, size=st.st_size, mtime=st.st_mtime_ns)
+        return checksum
+
+    def update(self, paths: typing.Iterable[pathlib.Path], workers: int = 4):
+        """
+        Make sure checksums for all existing files in `paths` are cached, computing missing ones
+        in parallel, and save the cache.
+        """
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(self.md5, [p for p in paths if p.exists()]))
+        self.save()
+
+    def save(self):
+        with self._lock:
+            # Remove entries for files which do not exist anymore:
+            self._data = {
+                k: v for k, v in self._data.items()
+                if self.path.parent.joinpath(k).exists() or  # noqa: W504
+                self.path.parent.joinpath(k.split('!')[0]).exists()}
+            dump(self._data, self.path, indent=4)
+
+
+class Counts:
+    """
+    A persistent cache of the numbers of samples and references in files, keyed by the md5
+    checksums of the files - see `scan_counts`.
+    """
+    def __init__(self, path: pathlib.Path):
+        self.path = path
+        self._data = load(path) if path.exists() else {}
+
+    def get(self, f: File, repos: 'GEOROC') -> typing.Tuple[int, int]:
+        """
+        Note: Counts for a local file which does not match the md5 checksum in the index (i.e. \
+        an outdated file) are not cached. Counts are only persisted by `save` (or `update`).
+
+        :return: Pair `(number of samples, number of references)`.
+        """
+        if f.md5 in self._data:
+            return tuple(self._data[f.md5])
+        counts = scan_counts(*f.location(repos))
+        if f.exists(repos):
+            self._data[f.md5] = list(counts)
+        return counts
+
+    def update(self, repos: 'GEOROC', files: typing.Iterable[File], workers: int = 4):
+        """
+        Make sure counts for all `files` which exist with correct checksum are cached, scanning
+        files with missing counts - and computing missing checksums - in parallel worker
+        processes, and save the cache (and `repos.checksums`).
+        """
+        todo = []
+        for f in files:
+            path, member = f.location(repos)
+            if f.md5 not in self._data and path.exists():
+                checksum = repos.checksums.cached(path, member=member)
+                if checksum in (None, f.md5):
+                    todo.append((f, path, member, checksum is None))
+        if not todo:
+            return
+        args = list(zip(*[t[1:] for t in todo]))
+        if workers > 1:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+                res = list(executor.map(_scan, *args))
+        else:
+            res = [_scan(*a) for a in zip(*args)]
+        for (f, path, member, hashed), (checksum, counts) in zip(todo, res):
+            if counts is None:  # The archive has no such member.
+                continue
+            if hashed:
+                repos.checksums.add(path, checksum, member=member)
+            if checksum in (None, f.md5):
+                self._data[f.md5] = list(counts)
+        self.save()
+        if any(t[3] for t in todo):
+            repos.checksums.save()
+
+    def save(self):
+        dump(self._data, self.path, indent=4)
+
+
+class SeenSet:
+    """
+    A set of strings - e.g. sample IDs - backed by a temporary SQLite database, which is spilled
+    to disk if it outgrows a page cache of `cache_size` KB. Thus, memory use is bounded.
+    """
+    def __init__(self, cache_size: int = 16384):
+        # An empty database name makes SQLite use a private temporary file, deleted on close.
+        self._conn = sqlite3.connect('')
+        for pragma in [
+            'journal_mode = OFF', 'synchronous = OFF', 'cache_size = -{}'.format(cache_size)
+        ]:
+            self._conn.execute('PRAGMA {};'.format(pragma))
+        self._conn.execute('CREATE TABLE seen (id PRIMARY KEY) WITHOUT ROWID')
+
+    def add(self, key) -> bool:
+        """
+        :return: `True` if `key` was not in the set before.
+        """
+        return self._conn.execute(
+            'INSERT OR IGNORE INTO seen (id) VALUES (?)', (key,)).rowcount == 1
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def column_name(s):
+    """
+    Normalise a column name in the CSV header to the key used in `Sample.data`.
+    """
+    s = s.replace(' ', '_')
+    return COL_MAP.get(s, s)
+
+
+@functools.lru_cache(maxsize=None)
 def col_type(s):
     if s in [
         'MIN._AGE_(YRS.)',  # '3480000000  / 3484000000'
@@ -174,27 +888,161 @@ def value_and_refs(v):
 def citations_converter(s):
     v, res = value_and_refs(s)
     assert not v
-    return collections.OrderedDict([(k, []) for k in res])
+    return {k: [] for k in res}
+
+
+class Columns:
+    """
+    The column descriptors of the sample data in a GEOROC CSV file, i.e. column names (after
+    mapping with `COL_MAP`) and types (as determined by `col_type`).
+
+    An instance is shared between all samples read from the same file.
+    """
+    __slots__ = ('names', 'types', 'index')
 
+    def __init__(self, names: typing.Iterable[str]):
+        self.names = tuple(names)
+        self.types = tuple(col_type(n) for n in self.names)
+        self.index = {n: i for i, n in enumerate(self.names)}
 
-@attr.s
+
+class SampleData(collections.abc.MutableMapping):
+    """
+    A `dict`-like container for the data of a sample, storing values positionally, according to
+    a shared `Columns` header.
+
+    Setting a value for an unknown key adds a column for this sample only. Deleting keys is not
+    supported.
+    """
+    __slots__ = ('header', 'cells')
+
+    def __init__(self, header: Columns, cells: list):
+        assert len(header.names) == len(cells)
+        self.header = header
+        self.cells = cells
+
+    @classmethod
+    def from_dict(cls, d: dict) -> 'SampleData':
+        return cls(Columns(d.keys()), list(d.values()))
+
+    def __getitem__(self, key):
+        return self.cells[self.header.index[key]]
+
+    def get(self, key, default=None):
+        i = self.header.index.get(key)
+        return default if i is None else self.cells[i]
+
+    def __contains__(self, key):
+        return key in self.header.index
+
+    def __setitem__(self, key, value):
+        i = self.header.index.get(key)
+        if i is None:
+            self.header = Columns(self.header.names + (key,))
+            self.cells.append(value)
+        else:
+            self.cells[i] = value
+
+    def __delitem__(self, key):
+        raise TypeError('Columns cannot be removed from sample data')
+
+    def __iter__(self):
+        return iter(self.header.names)
+
+    def __len__(self):
+        return len(self.cells)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+def convert_cells(data: SampleData, citations: dict):
+    """
+    Convert the raw values of a sample in place, i.e. strip citation markers - registering the
+    column as cited field in `citations` - and convert values to the column type.
+    """
+    cells = data.cells
+    for i, (k, type_) in enumerate(zip(data.header.names, data.header.types)):
+        v = cells[i]
+        if not v:
+            cells[i] = None
+            continue
+        if '[' in v:
+            v, refs = value_and_refs(v)
+            for ref in refs:
+                assert ref in citations
+                citations[ref].append(k)
+        else:  # The vast majority of values do not contain citation markers.
+            v = v.strip()
+        cells[i] = type_(v) if v else None
+
+
+def where_predicate(
+        where: typing.Union[None, dict, typing.Callable[[SampleData], bool]],
+) -> typing.Optional[typing.Callable[[SampleData], bool]]:
+    """
+    Turn a row filter into a predicate on `SampleData`.
+
+    :param where: A function accepting `SampleData` - or a `dict` mapping column names to \
+    either a value, compared for equality, or a function accepting the value of the column \
+    (`None` for missing values). All conditions must hold.
+    """
+    if where is None or callable(where):
+        return where
+    conds = [
+        (k, v if callable(v) else functools.partial(operator.eq, v)) for k, v in where.items()]
+    return lambda data: all(pred(data.get(k)) for k, pred in conds)
+
+
+def project(
+        samples: typing.Iterable['Sample'],
+        columns: typing.Optional[typing.Iterable[str]] = None,
+        where=None,
+        seen: typing.Optional['SeenSet'] = None,
+) -> typing.Generator['Sample', None, None]:
+    """
+    Select columns and filter samples which have been read completely - e.g. from a cache -
+    with the semantics of `FileReader.iter_samples`.
+    """
+    predicate, header, names = where_predicate(where), None, None
+    for sample in samples:
+        if seen is not None and not seen.add(sample.id):
+            continue
+        if columns is not None:
+            if header is not sample.data.header:
+                header = sample.data.header
+                selected = set(columns).union(where if isinstance(where, dict) else [])
+                names = Columns(k for k in header.names if k in selected)
+            sample.data = SampleData(names, [sample.data.get(k) for k in names.names])
+        if predicate is None or predicate(sample.data):
+            yield sample
+
+
+def sample_data(d: typing.Union[dict, SampleData]) -> SampleData:
+    if isinstance(d, SampleData):
+        return d
+    return SampleData.from_dict({COL_MAP.get(k, k): v for k, v in d.items()})
+
+
+@attr.s(slots=True)
 class Sample:
     id = attr.ib()
     name = attr.ib()
     citations = attr.ib(converter=citations_converter)
-    data = attr.ib()
+    data = attr.ib(converter=sample_data)
 
     def __attrs_post_init__(self):
-        for k, v in COL_MAP.items():
-            if k in self.data:
-                self.data[v] = self.data.pop(k)
+        convert_cells(self.data, self.citations)
 
-        for k in self.data:
-            v, refs = value_and_refs(self.data[k])
-            for ref in refs:
-                assert ref in self.citations
-                self.citations[ref].append(k)
-            self.data[k] = col_type(k)(v) if v else None
+    @classmethod
+    def from_parsed(cls, id, name, citations, data):
+        """
+        Create a sample from data which has been parsed before, e.g. read from a cache, i.e.
+        skipping the conversion of values.
+        """
+        sample = cls.__new__(cls)
+        sample.id, sample.name, sample.citations, sample.data = id, name, citations, data
+        return sample
 
     @classmethod
     def from_row(cls, row):
@@ -212,6 +1060,29 @@ class Sample:
 
 
 class GEOROC(API):
+    def __init__(self, repos=None, cache=None, archives=None):
+        """
+        :param cache: Directory for a persistent cache of parsed samples and references - or \
+        `True`, to use `<repos>/cache`. See `pygeoroc.cache`.
+        :param archives: Whether to store datasets as zip archives in `<repos>/archives` - \
+        reading the CSV files from the archives - rather than extracting the CSV files to \
+        `<repos>/csv`. If `None`, archives are used if `<repos>/archives` exists.
+        """
+        from pygeoroc.cache import Cache
+
+        API.__init__(self, repos)
+        self.archives = self.archivedir.exists() if archives is None else archives
+        if cache is True:
+            cache = self.path('cache')
+        self.cache = Cache(cache, self) if cache else None
+        # The parsed index, as triple (identity of datasets.json, datasets, file lookup):
+        self._index = None
+        # Offset indexes of the files, see `offset_index`:
+        self._offsets = {}
+        # Database connections are kept per thread, since `sqlite3` connections must not be shared
+        # between threads by default:
+        self._db = threading.local()
+
     @lazyproperty
     def converters(self):
         import importlib.util
@@ -224,30 +1095,200 @@ class GEOROC(API):
             return mod
         return argparse.Namespace(COORDINATES={}, FIELDS={})  # pragma: no cover
 
+    @lazyproperty
+    def checksums(self) -> Checksums:
+        """
+        Cache of checksums of the local files, stored next to `datasets.json`.
+        """
+        return Checksums(self.path('checksums.json'))
+
+    @lazyproperty
+    def counts(self) -> Counts:
+        """
+        Cache of the numbers of samples and references in files, stored next to `datasets.json`.
+        """
+        return Counts(self.path('counts.json'))
+
+    @lazyproperty
+    def columns_cache(self) -> typing.Dict[str, typing.List[str]]:
+        return {}
+
     @property
     def csvdir(self) -> pathlib.Path:
         return self.path('csv')
 
+    @property
+    def archivedir(self) -> pathlib.Path:
+        return self.path('archives')
+
     @property
     def dbpath(self) -> pathlib.Path:
         return self.path('georoc.sqlite')
 
-    def dbquery(self, sql, params=None):
-        with sqlite3.connect(str(self.dbpath)) as conn:
+    def dbconnection(self) -> sqlite3.Connection:
+        """
+        A connection to the database, reused for all queries from the same thread - thus
+        also reusing `sqlite3`'s cache of prepared statements.
+
+        If the database file has been replaced (e.g. by `georoc createdb --force`) since the
+        connection was opened, a new connection is opened.
+        """
+        try:
+            st = self.dbpath.stat()
+            identity = (st.st_dev, st.st_ino)
+        except FileNotFoundError:
+            identity = None
+        conn = getattr(self._db, 'conn', None)
+        if conn is not None and (identity is None or self._db.identity != identity):
+            conn.close()
+            conn = None
+        if conn is None:
+            conn = self._db.conn = sqlite3.connect(str(self.dbpath))
+            if identity is None:
+                st = self.dbpath.stat()
+                identity = (st.st_dev, st.st_ino)
+            self._db.identity = identity
+        return conn
+
+    def dbclose(self):
+        """
+        Close the database connection of the current thread.
+        """
+        conn = getattr(self._db, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._db.conn = None
+
+    def iter_dbquery(self, sql, params=None, arraysize=1000):
+        """
+        Run a query, streaming the results - i.e. fetching `arraysize` rows at a time.
+
+        :return: Generator of `OrderedDict` objects, mapping column names to values.
+        """
+        conn = self.dbconnection()
+        with conn:
             with contextlib.closing(conn.cursor()) as cu:
                 cu.execute(sql, params or ())
+                if cu.description is None:
+                    return
                 cols = [r[0] for r in cu.description]
-                res = [collections.OrderedDict(zip(cols, row)) for row in cu.fetchall()]
-        return res
+                while True:
+                    rows = cu.fetchmany(arraysize)
+                    if not rows:
+                        break
+                    for row in rows:
+                        yield collections.OrderedDict(zip(cols, row))
+
+    def dbquery(self, sql, params=None):
+        return list(self.iter_dbquery(sql, params=params))
+
+    def samples_in_bbox(
+            self,
+            west: float,
+            south: float,
+            east: float,
+            north: float,
+    ) -> typing.Generator[collections.OrderedDict, None, None]:
+        """
+        Query the database for samples with coordinates within a bounding box - or, for samples
+        specifying coordinate ranges, with ranges intersecting the box.
+
+        Boxes crossing the antimeridian are specified with `west > east`, e.g.
+        `(170, -20, -170, 0)`.
+
+        :return: Generator of rows of the `sample` table.
+        """
+        from pygeoroc.db import bbox_query
+
+        sql, params = bbox_query(west, south, east, north)
+        yield from self.iter_dbquery(sql, params)
 
     @property
-    def index(self):
-        with update(self.path('datasets.json'), default=[], indent=4) as data:
-            return [Dataset(md) for md in data]
+    def index(self) -> typing.List[Dataset]:
+        """
+        The datasets listed in `datasets.json`.
+
+        The file is only read again if it has changed (according to modification time and size)
+        since it was last read.
+        """
+        p = self.path('datasets.json')
+        try:
+            st = p.stat()
+            identity = (st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            identity = None
+        if self._index is None or self._index[0] != identity:
+            datasets = [Dataset(md) for md in load(p)] if identity else []
+            self._index = (
+                identity,
+                datasets,
+                {f.name: (ds, f) for ds in datasets for f in ds.files})
+        return self._index[1]
 
     @index.setter
     def index(self, datasets):
         dump(datasets, self.path('datasets.json'), indent=4)
+        self._index = None
+
+    def get_file(self, name: str) -> File:
+        """
+        Look up a file by name.
+
+        :raises KeyError: if there is no file with this name in the index.
+        """
+        self.index  # Make sure the lookup is up-to-date.
+        return self._index[2][name][1]
+
+    def get_dataset(self, fname: str) -> Dataset:
+        """
+        Look up the dataset containing the file named `fname`.
+
+        :raises KeyError: if there is no file with this name in the index.
+        """
+        self.index  # Make sure the lookup is up-to-date.
+        return self._index[2][fname][0]
+
+    def offset_index(self, f: File) -> 'OffsetIndex':  # noqa: F821
+        """
+        The index of row offsets of a file - loaded (or built) when first needed.
+        """
+        from pygeoroc.offsets import OffsetIndex
+
+        idx = self._offsets.get(f.name)
+        if idx is None or idx.file.md5 != f.md5:
+            idx = self._offsets[f.name] = OffsetIndex.load(f, self)
+        return idx
+
+    def get_samples(self, ids: typing.Iterable[str]) -> typing.Dict[str, Sample]:
+        """
+        Look up samples by ID, reading only their rows from the CSV files - see
+        `pygeoroc.offsets`. As for `iter_samples`, the first occurrence of a sample ID wins.
+
+        Note: Offset indexes of files are built when first needed, so the first lookup may \
+        require reading all files.
+
+        :return: `OrderedDict` mapping the IDs of the samples found to `Sample` objects, in the \
+        order of `ids`.
+        """
+        ids = list(ids)
+        todo, found = set(ids), {}
+        for f in self.iter_files():
+            if not todo:
+                break
+            idx = self.offset_index(f)
+            sids = [sid for sid in todo if sid in idx]
+            if sids:
+                found.update((s.id, s) for s in idx.get_samples(self, sids))
+                todo.difference_update(sids)
+        return collections.OrderedDict((sid, found[sid]) for sid in ids if sid in found)
+
+    def get_sample(self, id_: str) -> Sample:
+        """
+        Look up a sample by ID.
+
+        :raises KeyError: if there is no sample with this ID.
+        """
+        return self.get_samples([id_])[id_]
 
     def iter_files(self):
         for ds in self.index:
@@ -263,10 +1304,60 @@ class GEOROC(API):
                 else:
                     assert refs[id_] == ref  # pragma: no cover
 
-    def iter_samples(self):
-        sids = set()
+    def read_columns(self) -> typing.Dict[str, 'numpy.ndarray']:
+        """
+        Read the samples of all files into one `numpy.ndarray` per column.
+
+        Duplicate samples are skipped, i.e. as for `iter_samples`, the first occurrence wins.
+        Columns missing in a file are filled with `NaN` or `None`.
+
+        :return: `dict` mapping column names to arrays; the column `file` holds the file name.
+        """
+        import numpy
+
+        sids, chunks = set(), []
         for f in self.iter_files():
-            for sample in f.iter_samples(self):
-                if sample.id not in sids:
+            cols = f.read_columns(self)
+            keep = numpy.array(
+                [sid not in sids and not sids.add(sid) for sid in cols['UNIQUE_ID']], dtype=bool)
+            cols = collections.OrderedDict((k, a[keep]) for k, a in cols.items())
+            cols['file'] = numpy.full(int(keep.sum()), f.name, dtype=object)
+            chunks.append(cols)
+
+        keys = collections.OrderedDict()
+        for cols in chunks:
+            keys.update((k, a.dtype) for k, a in cols.items())
+        return collections.OrderedDict(
+            (k, numpy.concatenate([
+                cols[k] if k in cols else
+                numpy.full(len(cols['file']), numpy.nan if dtype.kind == 'f' else None, dtype)
+                for cols in chunks]) if chunks else numpy.array([], dtype=dtype))
+            for k, dtype in keys.items())
+
+    def iter_samples(
+            self,
+            columns: typing.Optional[typing.Iterable[str]] = None,
+            where=None,
+            files: typing.Optional[typing.Container[str]] = None,
+            sections: typing.Optional[typing.Container[str]] = None,
+    ) -> typing.Generator[typing.Tuple[Sample, File], None, None]:
+        """
+        Iterate over the samples of all files, skipping duplicates, i.e. the first occurrence
+        of a sample ID wins.
+
+        :param columns: Names of the columns to read - see `FileReader.iter_samples`.
+        :param where: Row filter - see `where_predicate`.
+        :param files: Names of the files to read.
+        :param sections: Names of the datasets to read files from.
+
+        Note: Files excluded via `files` or `sections` are not opened. So duplicates are only \
+        detected among the samples in the selected files. Duplicates are detected before \
+        filtering with `where`, i.e. the result is the same as filtering all samples.
+        """
+        with SeenSet() as sids:
+            for f in self.iter_files():
+                if (files is not None and f.name not in files) or \
+                        (sections is not None and f.section not in sections):
+                    continue
+                for sample in f.iter_samples(self, columns=columns, where=where, seen=sids):
                     yield sample, f
-                    sids.add(sample.id)
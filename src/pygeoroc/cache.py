@@ -0,0 +1,174 @@
+"""
+A persistent cache of the parsed - and fixed - samples and references of GEOROC CSV files.
+
+Cache files are keyed by the md5 checksum of the CSV file and a hash of the repository's
+`converters.py` (as well as the cache format version and the Python version, since samples are
+pickled), so that changes to the data or to the errata invalidate the cache.
+
+A cache file starts with `MAGIC`, followed by records, each consisting of a 1-byte kind, the
+4-byte little-endian length of the payload and the pickled payload:
+
+- `b'h'`: the column names of the samples, i.e. the `Columns` header shared by the samples \
+  following it,
+- `b's'`: a sample, as tuple `(id, name, citations, cells)`,
+- `b'r'`: the list of references, as `(id, reference)` pairs.
+
+Thus, cache files can be scanned (memory-mapped) record by record, only unpickling the records
+of interest - see `iter_records`.
+"""
+import os
+import sys
+import mmap
+import pickle
+import struct
+import typing
+import hashlib
+import pathlib
+import contextlib
+
+from clldutils.misc import lazyproperty
+from clldutils.path import md5
+
+from pygeoroc import timing
+from pygeoroc.api import File, FileReader, Columns, SampleData, Sample, project
+
+__all__ = ['Cache', 'CachedReader', 'iter_records']
+
+MAGIC = b'PYGEOROC-CACHE\n'
+VERSION = 1
+HEADER, SAMPLE, REFERENCES = b'h', b's', b'r'
+_RECORD = struct.Struct('<cI')
+
+
+def write_record(fp, kind: bytes, obj):
+    payload = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    fp.write(_RECORD.pack(kind, len(payload)))
+    fp.write(payload)
+
+
+def iter_records(
+        path: pathlib.Path,
+        kinds: typing.Optional[typing.Container[bytes]] = None,
+) -> typing.Generator[typing.Tuple[bytes, typing.Any], None, None]:
+    """
+    Scan a cache file, without reading it into memory.
+
+    :param kinds: If specified, only records of these kinds are unpickled and returned.
+    :return: Generator of pairs `(kind, object)`.
+    """
+    with path.open('rb') as fp:
+        with contextlib.closing(mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)) as mm:
+            if mm[:len(MAGIC)] != MAGIC:
+                raise ValueError('Not a pygeoroc cache file: {}'.format(path))
+            pos, size = len(MAGIC), len(mm)
+            while pos < size:
+                kind, n = _RECORD.unpack_from(mm, pos)
+                pos += _RECORD.size
+                if kinds is None or kind in kinds:
+                    yield kind, pickle.loads(mm[pos:pos + n])
+                pos += n
+
+
+class Cache:
+    """
+    A directory of cache files.
+    """
+    def __init__(self, path: typing.Union[str, pathlib.Path], api):
+        self.path = pathlib.Path(path)
+        self.api = api
+
+    @lazyproperty
+    def key(self) -> str:
+        """
+        Hash of the parameters - other than the CSV file - determining the cached data.
+        """
+        conv = self.api.path('converters.py')
+        return hashlib.md5('{} {}.{} {}'.format(
+            VERSION,
+            sys.version_info[0],
+            sys.version_info[1],
+            md5(conv) if conv.exists() else '').encode('utf8')).hexdigest()
+
+    def path_for(self, f: File) -> pathlib.Path:
+        return self.path / '{}.{}.cache'.format(f.md5, self.key)
+
+    def reader(self, f: File) -> 'CachedReader':
+        return CachedReader(self, f)
+
+
+class CachedReader:
+    """
+    A drop-in replacement for `FileReader`, reading samples and references from the cache if
+    possible, otherwise reading the CSV file and writing the cache while doing so.
+
+    Note: Since cached samples have been fixed already, errata are only reported when the cache
+    is written.
+    """
+    def __init__(self, cache: Cache, f: File):
+        self.cache = cache
+        self.file = f
+        self.path = cache.path_for(f)
+        self._references = None
+
+    def iter_samples(self, stdout=False, columns=None, where=None, seen=None) \
+            -> typing.Generator[Sample, None, None]:
+        if self.path.exists():
+            samples = timing.timed('cache', self._read_samples(), file=self.file.name)
+        else:
+            # The cache holds complete samples, so columns are selected after writing it:
+            samples = self._write(stdout)
+        if columns is None and where is None and seen is None:
+            yield from samples
+        else:
+            yield from project(samples, columns=columns, where=where, seen=seen)
+
+    def _read_samples(self):
+        header = None
+        for kind, obj in iter_records(self.path, kinds={HEADER, SAMPLE}):
+            if kind == SAMPLE:
+                id_, name, citations, cells = obj
+                yield Sample.from_parsed(id_, name, citations, SampleData(header, cells))
+            else:
+                header = Columns(obj)
+
+    def _write(self, stdout):
+        """
+        Read the CSV file, writing samples to the cache before passing them on.
+
+        The cache file is only moved into place if the CSV file has been read completely.
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Remove cache files for the same data but outdated converters:
+        for p in self.path.parent.glob('{}.*.cache'.format(self.file.md5)):
+            p.unlink()
+        reader = FileReader(self.file, self.cache.api)
+        tmp = self.path.with_name('{}.{}-{}.tmp'.format(self.path.name, os.getpid(), id(self)))
+        try:
+            with tmp.open('wb') as fp:
+                fp.write(MAGIC)
+                header = None
+                for sample in reader.iter_samples(stdout=stdout):
+                    if sample.data.header is not header:
+                        header = sample.data.header
+                        write_record(fp, HEADER, header.names)
+                    write_record(
+                        fp,
+                        SAMPLE,
+                        (sample.id, sample.name, sample.citations, sample.data.cells))
+                    yield sample
+                self._references = reader.references
+                write_record(fp, REFERENCES, self._references)
+            tmp.replace(self.path)
+        finally:
+            if tmp.exists():
+                tmp.unlink()
+
+    @property
+    def references(self) -> typing.List[typing.Tuple[int, str]]:
+        if self._references is None:
+            if self.path.exists():
+                self._references = next(iter_records(self.path, kinds={REFERENCES}))[1]
+            else:
+                for _ in self._write(stdout=None):
+                    pass
+        return self._references
@@ -7,24 +7,77 @@ import subprocess
 
 from clldutils.clilib import PathType
 
-from pygeoroc.db import Database
+from pygeoroc.db import Database, INDEXES
+
+
+def index_spec(s):
+    """
+    Parse an index specification of the form `table:column[,column...]`.
+    """
+    table, _, cols = s.partition(':')
+    if not (table and cols):
+        raise ValueError(s)
+    return table, tuple(c.strip() for c in cols.split(','))
 
 
 def register(parser):
     parser.add_argument('-f', '--force', default=False, action='store_true')
+    parser.add_argument(
+        '-u', '--update',
+        default=False,
+        action='store_true',
+        help='Update an existing database, only (re)loading new or changed files (and files '
+             'containing duplicates of their samples)')
+    parser.add_argument(
+        '--fast',
+        default=False,
+        action='store_true',
+        help='Use a bulk-load profile for SQLite (no journal, no sync, deferred foreign key '
+             'checks), finishing with ANALYZE and VACUUM. With --update, a journaled profile '
+             '(normal sync) is used instead, committing the update in one transaction')
     parser.add_argument('--dump-schema', default=False, action='store_true')
     parser.add_argument('--archive', type=PathType(type='dir'))
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=1,
+        help='Number of worker processes to use for parsing the CSV files')
+    parser.add_argument(
+        '--index',
+        metavar='TABLE:COLUMN[,COLUMN...]',
+        type=index_spec,
+        action='append',
+        default=[],
+        help='Additional secondary index to create (by default, indexes on {} are created)'.format(
+            '; '.join('{}({})'.format(t, ', '.join(c)) for t, c in INDEXES)))
+    parser.add_argument(
+        '--no-default-indexes',
+        default=False,
+        action='store_true',
+        help='Do not create the default secondary indexes')
+    parser.add_argument(
+        '--no-spatial-index',
+        default=False,
+        action='store_true',
+        help='Do not create the R*Tree index of sample coordinates used by `georoc query`')
 
 
 def run(args):
-    if args.repos.dbpath.exists():
-        if args.force:
-            args.repos.dbpath.unlink()
-        else:
-            print('DB exists at {}. Use --force to recreate.'.format(args.repos.dbpath))
+    db = Database(
+        args.repos.dbpath,
+        indexes=([] if args.no_default_indexes else INDEXES) + args.index,
+        spatial=not args.no_spatial_index)
+    if args.repos.dbpath.exists() and not args.force:
+        if not args.update:
+            print('DB exists at {}. Use --force to recreate or --update to update.'.format(
+                args.repos.dbpath))
             return
-    db = Database(args.repos.dbpath)
-    db.create(args.repos)
+        files = db.update(args.repos, workers=args.workers, fast=args.fast)
+        args.log.info('{} new or changed files loaded'.format(len(files)))
+    else:
+        if args.repos.dbpath.exists():
+            args.repos.dbpath.unlink()
+        db.create(args.repos, workers=args.workers, fast=args.fast)
     if args.dump_schema:
         print(subprocess.check_output(['sqlite3', str(args.repos.dbpath), '.schema']))
     if args.archive:
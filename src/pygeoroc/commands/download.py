@@ -1,14 +1,60 @@
 """
 Download precompiled files from GEOROC
 """
+import concurrent.futures
+
 from pygeoroc import DATASETS
-from pygeoroc.api import Dataset
+
+
+def register(parser):
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=4,
+        help='Maximal number of datasets to download concurrently')
+    parser.add_argument(
+        '--retries',
+        type=int,
+        default=3,
+        help='Number of times a failed request for dataset metadata is retried')
+
+
+async def download(args, session, dois):
+    """
+    Fetch the metadata of all datasets concurrently, starting the download of the files of a
+    dataset as soon as its metadata is available.
+
+    :return: `list` of dataset metadata, in the order of `dois`.
+    """
+    import asyncio
+    from pygeoroc.dataverse import Client
+
+    loop = asyncio.get_running_loop()
+    # Instantiate the checksum cache before it is accessed from the worker threads, because
+    # `lazyproperty` is not thread-safe - i.e. threads could create (and update) separate caches:
+    args.repos.checksums
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.workers) as executor:
+        async with Client(session=session, retries=args.retries) as client:
+            async def download_dataset(doi):
+                ds = await client.dataset(doi)
+                await loop.run_in_executor(
+                    executor,
+                    lambda: ds.download_files(args.repos, log=args.log, session=session))
+                return ds.md
+
+            return list(await asyncio.gather(*[download_dataset(doi) for doi in dois]))
 
 
 def run(args):
-    datasets = []
-    for doi, name in sorted(DATASETS.items(), key=lambda i: i[1]):
-        ds = Dataset.from_doi(doi)
-        datasets.append(ds.md)
-        ds.download_files(args.repos, log=args.log)
-    args.repos.index = datasets
+    import asyncio
+    import requests
+
+    session = requests.Session()
+    session.mount(
+        'https://',
+        requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=args.workers + 8))
+    with session:
+        # Sort by dataset name - `asyncio.gather` returns results in order:
+        args.repos.index = asyncio.run(download(
+            args, session, [doi for doi, _ in sorted(DATASETS.items(), key=lambda i: i[1])]))
+    args.repos.checksums.save()
@@ -0,0 +1,28 @@
+"""
+Export GEOROC data to columnar files in Apache Parquet or Arrow IPC format
+
+Requires pyarrow to be installed, e.g. via "pip install pygeoroc[arrow]".
+"""
+from clldutils.clilib import PathType
+
+from pygeoroc.export import Exporter, FORMATS, BATCH_SIZE
+
+
+def register(parser):
+    parser.add_argument('--format', choices=sorted(FORMATS), default='parquet')
+    parser.add_argument(
+        '--outdir',
+        type=PathType(type='dir', must_exist=False),
+        default=None,
+        help='Output directory (defaults to a directory in the repository named by the format)')
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=BATCH_SIZE,
+        help='Number of rows written at once')
+
+
+def run(args):
+    outdir = args.outdir or args.repos.path(args.format)
+    Exporter(outdir, fmt=args.format, batch_size=args.batch_size).export(args.repos)
+    args.log.info(outdir)
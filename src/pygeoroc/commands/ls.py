@@ -13,6 +13,11 @@ def register(parser):
     parser.add_argument('--dataset', default=None)
     parser.add_argument('--samples', default=False, action='store_true')
     parser.add_argument('--references', default=False, action='store_true')
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=4,
+        help='Number of worker processes to use for counting samples and references')
 
 
 def run(args):
@@ -22,19 +27,16 @@ def run(args):
         return
 
     if args.datasets_only:
+        datasets = args.repos.index
         with Table(args, 'dataset', 'files', 'size') as t:
             totalfiles, totalsize = 0, 0
-            for dataset in args.repos.index:
+            for dataset in datasets:
+                size = sum(f.size for f in dataset.files)
                 totalfiles += len(dataset.files)
-                totalsize += sum(f.size for f in dataset.files)
-                t.append([
-                    dataset.name,
-                    len(dataset.files),
-                    format_size(sum(f.size for f in dataset.files))])
+                totalsize += size
+                t.append([dataset.name, len(dataset.files), format_size(size)])
             t.append([
-                'total: {} datasets'.format(len(args.repos.index)),
-                totalfiles,
-                format_size(totalsize)])
+                'total: {} datasets'.format(len(datasets)), totalfiles, format_size(totalsize)])
         return
 
     if args.index:  # pragma: no cover
@@ -52,6 +54,13 @@ as listed below.
         if args.references:
             t.columns.append('# references')
         t.columns.append('path')
+        if args.samples or args.references:
+            # Scan the files with uncached counts in parallel:
+            args.repos.counts.update(
+                args.repos,
+                [f for ds in args.repos.index if not args.dataset or (args.dataset in ds.name)
+                 for f in ds.files],
+                workers=args.workers)
         for ds in args.repos.index:
             if not args.dataset or (args.dataset in ds.name):
                 for f in ds.files:
@@ -62,8 +71,8 @@ as listed below.
                         f.date
                     ]
                     if args.samples:
-                        row.append(len(list(f.iter_samples(args.repos, stdout=None))))
+                        row.append(f.count_samples(args.repos))
                     if args.references:
-                        row.append(len(list(f.iter_references(args.repos))))
+                        row.append(f.count_references(args.repos))
                     row.append(f.name)
                     t.append(row)
@@ -0,0 +1,47 @@
+"""
+Query the SQLite database for samples within a bounding box
+"""
+from clldutils.clilib import Table, add_format
+
+from pygeoroc.db import check_bbox
+
+COLUMNS = [
+    'id', 'file_id', 'LOCATION', 'LATITUDE_MIN', 'LATITUDE_MAX', 'LONGITUDE_MIN', 'LONGITUDE_MAX']
+
+
+def register(parser):
+    add_format(parser, 'simple')
+    parser.add_argument(
+        '--bbox',
+        nargs=4,
+        type=float,
+        metavar=('WEST', 'SOUTH', 'EAST', 'NORTH'),
+        required=True,
+        help='Bounding box in decimal degrees; boxes crossing the antimeridian are specified '
+             'with WEST > EAST')
+    parser.add_argument(
+        '--column',
+        action='append',
+        default=[],
+        help='Column of the sample table to display (default: {})'.format(', '.join(COLUMNS)))
+
+
+def run(args):
+    try:
+        check_bbox(*args.bbox)
+    except ValueError as e:
+        args.log.error('{} - SOUTH must not exceed NORTH, latitudes must be within [-90, 90], '
+                       'longitudes within [-180, 180]'.format(e))
+        return 1
+    if not args.repos.dbpath.exists():
+        args.log.error('No database at {}. Run `georoc createdb` first.'.format(args.repos.dbpath))
+        return 1
+    if not args.repos.dbquery("SELECT name FROM sqlite_master WHERE name = 'sample_bbox_id'"):
+        args.log.error(
+            'The database has no spatial index. Run `georoc createdb --update` to create it.')
+        return 1
+
+    cols = args.column or COLUMNS
+    with Table(args, *cols) as t:
+        for row in args.repos.samples_in_bbox(*args.bbox):
+            t.append([row.get(c) for c in cols])
@@ -0,0 +1,114 @@
+"""
+An asyncio client for the Dataverse API, fetching metadata of many datasets concurrently.
+
+Requests are made with a shared `requests.Session` - thus reusing connections - run in a pool of
+worker threads, with concurrency bounded by a semaphore. Requests failing with a connection
+error or a server error (or `429 Too Many Requests`) are retried with exponential backoff.
+"""
+import asyncio
+import typing
+import functools
+import concurrent.futures
+
+import requests
+
+from pygeoroc.api import api_call, Dataset
+
+__all__ = ['Client', 'run_sync']
+
+# HTTP status codes of responses signaling a temporary problem, i.e. worth retrying:
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class Client:
+    """
+    .. code-block:: python
+
+        async with Client() as client:
+            datasets = await client.datasets(['doi:10.25625/JUQK7N', 'doi:10.25625/JRZIJF'])
+    """
+    def __init__(
+            self,
+            session: typing.Optional[requests.Session] = None,
+            concurrency: int = 8,
+            retries: int = 3,
+            backoff: float = 0.5):
+        """
+        :param session: Session to use - if `None`, a session is created and closed on exit.
+        :param concurrency: Maximal number of requests in flight.
+        :param retries: Number of times a failed request is retried.
+        :param backoff: Seconds to wait before the first retry, doubled for each further retry.
+        """
+        self._own_session = session is None
+        self.session = session or requests.Session()
+        if self._own_session:
+            self.session.mount('https://', requests.adapters.HTTPAdapter(
+                pool_connections=1, pool_maxsize=concurrency))
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        # Before Python 3.10, a semaphore is bound to the event loop at creation, so we create it
+        # when it is first used:
+        self._semaphore = None
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        if self._own_session:
+            self.session.close()
+
+    async def get(self, path: str, **kw) -> requests.Response:
+        """
+        Asynchronous version of `pygeoroc.api.api_call`, retrying failed requests.
+
+        :raises requests.HTTPError: If the request still fails after the last retry.
+        """
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._semaphore:
+            for attempt in range(self.retries + 1):
+                last = attempt == self.retries
+                try:
+                    res = await loop.run_in_executor(
+                        self._executor,
+                        functools.partial(api_call, path, session=self.session, **kw))
+                except (requests.ConnectionError, requests.Timeout):
+                    if last:
+                        raise
+                else:
+                    if res.status_code not in RETRY_STATUS or last:
+                        res.raise_for_status()
+                        return res
+                await asyncio.sleep(self.backoff * 2 ** attempt)
+
+    async def dataset(self, doi: str) -> Dataset:
+        res = await self.get('datasets/:persistentId/?persistentId=' + doi)
+        return Dataset(res.json()['data'])
+
+    async def datasets(self, dois: typing.Iterable[str]) -> typing.List[Dataset]:
+        """
+        Fetch the metadata of datasets concurrently.
+
+        :return: `list` of datasets, in the order of `dois`.
+        """
+        return list(await asyncio.gather(*[self.dataset(doi) for doi in dois]))
+
+
+def run_sync(coro):
+    """
+    Run a coroutine to completion from synchronous code - also if called from a thread running
+    an event loop, e.g. in a Jupyter notebook.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coro).result()
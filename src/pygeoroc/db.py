@@ -1,37 +1,405 @@
 import re
+import typing
 import sqlite3
+import functools
 import contextlib
 import collections
+import concurrent.futures
 
-from tqdm import tqdm
-from pygeoroc.api import col_type
+from pygeoroc import timing
+
+# Settings used for bulk loading with `fast=True`, trading durability during the build for speed:
+FAST_PRAGMAS = [
+    'journal_mode = OFF',
+    'synchronous = OFF',
+    'cache_size = -524288',  # i.e. 512MB
+    'temp_store = MEMORY',
+]
+# Settings used for updates with `fast=True`. Since an update deletes data before reloading
+# files, it must be possible to roll it back, so we keep a rollback journal. (WAL mode would
+# persist in the database file, i.e. would have to be reverted - which requires exclusive access.)
+FAST_UPDATE_PRAGMAS = [
+    'journal_mode = DELETE',
+    'synchronous = NORMAL',
+    'cache_size = -524288',
+    'temp_store = MEMORY',
+    'foreign_keys = ON',
+]
+# Number of sample rows after which a transaction is committed with `fast=True`:
+CHUNKSIZE = 100000
+# Secondary indexes created by default, as pairs (table, columns). Indexes on columns which are
+# not in the database are skipped.
+INDEXES = [
+    ('citation', ('sample_id', 'reference_id')),  # A covering index for joins with `sample`.
+    ('citation', ('reference_id',)),
+    ('sample', ('file_id',)),
+    ('sample', ('LOCATION',)),
+    ('sample', ('LATITUDE_MIN', 'LONGITUDE_MIN')),
+]
+
+
+# The coordinate columns of the `sample` table, indexed in the R*Tree `sample_bbox`. Since the
+# implicit `rowid` of `sample` may change (e.g. with `VACUUM`), the R*Tree is keyed on the
+# `INTEGER PRIMARY KEY` of the table `sample_bbox_id`, mapping these keys to `sample.id`:
+COORDINATES = ['LATITUDE_MIN', 'LATITUDE_MAX', 'LONGITUDE_MIN', 'LONGITUDE_MAX']
+
+
+def _bbox(coord, func, alias='s'):
+    """
+    SQL expression for a bound of the coordinate range of a sample. Since samples may specify
+    only one of min and max, we fill in the other.
+    """
+    mn, mx = ['{}.{}_{}'.format(alias, coord, k) for k in ['MIN', 'MAX']]
+    return '{}(coalesce({}, {}), coalesce({}, {}))'.format(func, mn, mx, mx, mn)
+
+
+# Map the columns of `sample_bbox` to SQL expressions computing their values:
+BBOX = collections.OrderedDict([
+    ('lat_min', _bbox('LATITUDE', 'min')),
+    ('lat_max', _bbox('LATITUDE', 'max')),
+    ('lon_min', _bbox('LONGITUDE', 'min')),
+    ('lon_max', _bbox('LONGITUDE', 'max')),
+])
+
+
+def check_bbox(west: float, south: float, east: float, north: float):
+    """
+    :raises ValueError: if the bounding box is invalid.
+    """
+    if not (-90 <= south <= north <= 90 and -180 <= west <= 180 and -180 <= east <= 180):
+        raise ValueError('Invalid bounding box: {}'.format((west, south, east, north)))
+
+
+def bbox_query(west: float, south: float, east: float, north: float, columns='s.*'):
+    """
+    SQL query selecting samples with coordinates (ranges) intersecting a bounding box.
+
+    Candidates are retrieved from the R*Tree `sample_bbox`, which stores 32-bit floats rounded
+    outwards, mapped to samples via `sample_bbox_id` and then filtered exactly on the coordinates
+    in the `sample` table.
+
+    If `west > east`, the box is assumed to cross the antimeridian, i.e. to span the longitudes
+    `[west, 180]` and `[-180, east]`.
+
+    :return: pair (SQL, parameters)
+    """
+    check_bbox(west, south, east, north)
+    lat = 'lat_max >= :south AND lat_min <= :north'
+    cond = ' AND '.join([
+        "{} >= :south".format(BBOX['lat_max']),
+        "{} <= :north".format(BBOX['lat_min']),
+    ])
+    if west <= east:
+        candidates = 'SELECT id FROM sample_bbox ' \
+            'WHERE {} AND lon_max >= :west AND lon_min <= :east'.format(lat)
+        cond += ' AND {} >= :west AND {} <= :east'.format(BBOX['lon_max'], BBOX['lon_min'])
+    else:
+        candidates = 'SELECT id FROM sample_bbox WHERE {0} AND lon_max >= :west ' \
+            'UNION SELECT id FROM sample_bbox WHERE {0} AND lon_min <= :east'.format(lat)
+        cond += ' AND ({} >= :west OR {} <= :east)'.format(BBOX['lon_max'], BBOX['lon_min'])
+    return (
+        'SELECT {} FROM sample AS s WHERE s.id IN '
+        '(SELECT sample_id FROM sample_bbox_id WHERE id IN ({})) AND {}'.format(
+            columns, candidates, cond),
+        dict(west=west, south=south, east=east, north=north))
+
+
+def index_name(table, cols):
+    return re.sub('[^A-Za-z0-9_]', '_', 'idx_{}_{}'.format(table, '_'.join(cols)))
+
+
+# The API instance used by a worker process, initialised in `_init_worker`:
+_worker_api = None
+
+
+def _init_worker(repos, timings=False, cache=None, archives=None):  # pragma: no cover
+    from pygeoroc.api import GEOROC
+
+    global _worker_api
+    _worker_api = GEOROC(repos, cache=cache, archives=archives)
+    if timings:
+        timing.enable()
+
+
+def _parse_file(cols, f, api=None):
+    """
+    Parse one file into the data to be inserted into the database.
+
+    This is a module-level function, so that it can be run in a worker process.
+
+    :return: triple (list of references, list of (sample row, citations) pairs, timings) - \
+    where timings are only returned when instrumentation is enabled in a worker process, to be \
+    merged by the writer.
+    """
+    reader = f.reader(api or _worker_api)
+    samples = []
+    for sample in reader.iter_samples():
+        samples.append((
+            tuple([sample.id, f.name] + [sample.data.get(c) for c in cols]),
+            [(sample.id, cit, ' '.join(fields)) for cit, fields in sample.citations.items()]))
+    references = reader.references
+    return references, samples, timing.get().reset() if api is None and timing.get() else None
+
+
+def _imap(executor, func, items, maxpending):
+    """
+    Like `executor.map`, but only keeps up to `maxpending` tasks in flight, thus bounding the
+    amount of parsed data waiting for the consumer.
+    """
+    pending, items = collections.deque(), iter(items)
+    for item in items:
+        pending.append(executor.submit(func, item))
+        if len(pending) >= maxpending:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
 
 
 class Database:
-    def __init__(self, fname):
+    def __init__(self, fname, indexes=None, spatial=True):
+        """
+        :param indexes: Secondary indexes to create, as list of pairs (table, columns) - \
+        defaulting to `INDEXES`.
+        :param spatial: Flag signaling whether to create the R*Tree `sample_bbox`, indexing \
+        the coordinates of samples (keyed via the table `sample_bbox_id`).
+        """
         self.fname = fname
+        self.indexes = INDEXES if indexes is None else indexes
+        self.spatial = spatial
+
+    def create(self, api, workers=1, fast=False):
+        """
+        :param workers: Number of worker processes used to parse the files. Parsed data is \
+        written by a single writer in the order of `api.index`, so the resulting database does \
+        not depend on the number of workers.
+        :param fast: Flag signaling whether to use a bulk-load profile, i.e. disable journaling \
+        and syncing, use a big page cache, check foreign keys only once after loading, commit \
+        in chunks and run `ANALYZE` and `VACUUM` at the end. The resulting database is the same.
+        """
+        files = list(api.iter_files())
+        cols = self._columns(api, files)
+        with self._connect(FAST_PRAGMAS if fast else None) as conn:
+            with contextlib.closing(conn.cursor()) as cu:
+                self._create_schema(cu, cols)
+                self._load(cu, cols, api, files, workers, chunksize=CHUNKSIZE if fast else None)
+                # Indexes are created after loading, which is faster than updating them:
+                self._create_indexes(cu)
+                if not fast:
+                    self._sync_bbox(cu)
+            if fast:
+                self._finish(conn)
 
-    def create(self, api):
-        cols, files = {}, []
-        for f in api.iter_files():
-            files.append(f)
-            for sample in f.iter_samples(api):
-                for key in sample.data:
-                    if key:
-                        cols[key] = 'REAL' if col_type(key) is float else 'TEXT'
-                break
-        cols = collections.OrderedDict(sorted(
+    def update(self, api, workers=1, fast=False):
+        """
+        Update an existing database, by (re)loading only files which are new or have changed
+        (according to their md5 checksum) since the database was built.
+
+        Samples and citations from changed or removed files are deleted, columns which are new
+        since the last build are added to the `sample` table. References are never deleted.
+
+        To keep the first occurrence of a sample in the order of `api.index`, as for `create`,
+        files are reloaded as well, if
+        - they contain duplicates of deleted samples (as recorded in the table \
+          `sample_duplicate`) or
+        - they contain samples which are also contained in a (re)loaded file preceding them in \
+          the index.
+
+        :param fast: Flag signaling whether to use SQLite settings for faster loading. Unlike \
+        with `create`, the database is journaled and the update is committed in \
+        one transaction, so that it is rolled back completely in case of errors. `ANALYZE` and \
+        `VACUUM` are not run.
+        :return: `list` of the (re)loaded files.
+        """
+        files = list(api.iter_files())
+        position = {f.name: i for i, f in enumerate(files)}
+        res = {}
+        with self._connect(FAST_UPDATE_PRAGMAS if fast else None) as conn:
+            with contextlib.closing(conn.cursor()) as cu:
+                if 'md5' not in self._table_columns(cu, 'file'):
+                    # A database created before checksums were recorded: reload everything.
+                    cu.execute("ALTER TABLE file ADD COLUMN md5 TEXT")
+                if not self._table_columns(cu, 'sample_duplicate'):
+                    # A database created before duplicates were recorded: reload everything.
+                    self._create_duplicate_table(cu)
+                    cu.execute("UPDATE file SET md5 = NULL")
+                cu.execute("SELECT id, md5 FROM file")
+                loaded = dict(cu.fetchall())
+                md5s = {f.name: f.md5 for f in files}
+                self._delete_files(
+                    cu, [fid for fid, md5 in loaded.items() if md5s.get(fid) != md5], loaded)
+                todo = [f for f in files if f.name not in loaded]
+
+                cols = collections.OrderedDict(
+                    (k, v) for k, v in self._table_columns(cu, 'sample').items()
+                    if k not in ['id', 'file_id'])
+                for col, type_ in self._columns(api, todo).items():
+                    if col not in cols:
+                        cu.execute("ALTER TABLE sample ADD COLUMN `{}` {}".format(col, type_))
+                        cols[col] = type_
+
+                while todo:
+                    self._load(cu, cols, api, todo, workers)
+                    res.update((f.name, f) for f in todo)
+                    loaded.update((f.name, f.md5) for f in todo)
+                    # Samples skipped in (re)loaded files, because they were loaded from a file
+                    # following in the index, must be loaded from the (re)loaded file:
+                    cu.execute(
+                        "SELECT DISTINCT d.file_id, s.file_id FROM sample_duplicate AS d, "
+                        "sample AS s WHERE d.sample_id = s.id")
+                    self._delete_files(
+                        cu,
+                        {fid for dup, fid in cu.fetchall() if position[fid] > position[dup]},
+                        loaded)
+                    todo = [f for f in files if f.name not in loaded]
+                self._create_indexes(cu)
+                self._sync_bbox(cu)
+        return sorted(res.values(), key=lambda f: position[f.name])
+
+    def _delete_files(self, cu, fids: typing.Iterable[str], loaded: dict):
+        """
+        Delete files from the database - and, since duplicates of samples are skipped when
+        loading, all files containing duplicates of the deleted samples, recursively.
+
+        :param loaded: `dict` of the files in the database, from which deleted files are removed.
+        """
+        fids = set(fids)
+        while fids:
+            deleted = set()
+            for fid in fids:
+                deleted |= self._delete_file(cu, fid)
+                del loaded[fid]
+            cu.execute("CREATE TEMP TABLE IF NOT EXISTS deleted_sample (id TEXT PRIMARY KEY)")
+            cu.executemany("INSERT INTO deleted_sample (id) VALUES (?)", [(i,) for i in deleted])
+            cu.execute(
+                "SELECT DISTINCT file_id FROM sample_duplicate "
+                "WHERE sample_id IN (SELECT id FROM deleted_sample)")
+            fids = {r[0] for r in cu.fetchall()}
+            cu.execute("DELETE FROM deleted_sample")
+
+    def _delete_file(self, cu, fid: str) -> typing.Set[str]:
+        """
+        Delete a file and its samples, duplicates and citations from the database.
+
+        :return: IDs of the deleted samples.
+        """
+        cu.execute("SELECT id FROM sample WHERE file_id = ?", (fid,))
+        sids = {r[0] for r in cu.fetchall()}
+        cu.execute(
+            "DELETE FROM citation WHERE sample_id IN (SELECT id FROM sample WHERE file_id = ?)",
+            (fid,))
+        if self._table_columns(cu, 'sample_bbox_id'):
+            ids = "SELECT b.id FROM sample_bbox_id AS b, sample AS s " \
+                  "WHERE b.sample_id = s.id AND s.file_id = ?"
+            cu.execute("DELETE FROM sample_bbox WHERE id IN ({})".format(ids), (fid,))
+            cu.execute("DELETE FROM sample_bbox_id WHERE id IN ({})".format(ids), (fid,))
+        cu.execute("DELETE FROM sample_duplicate WHERE file_id = ?", (fid,))
+        cu.execute("DELETE FROM sample WHERE file_id = ?", (fid,))
+        cu.execute("DELETE FROM file WHERE id = ?", (fid,))
+        return sids
+
+    def _connect(self, pragmas=None):
+        conn = sqlite3.connect(str(self.fname))
+        for pragma in pragmas or ['foreign_keys = ON']:
+            conn.execute('PRAGMA {};'.format(pragma))
+        return conn
+
+    def _finish(self, conn):
+        """
+        Check the foreign keys which were not enforced while bulk-loading and optimize the db.
+        """
+        conn.commit()
+        violations = conn.execute('PRAGMA foreign_key_check;').fetchall()
+        if violations:
+            raise sqlite3.IntegrityError(  # pragma: no cover
+                'FOREIGN KEY constraint failed: {}'.format(violations[:10]))
+        conn.execute('ANALYZE;')
+        conn.execute('VACUUM;')
+        with contextlib.closing(conn.cursor()) as cu:
+            self._sync_bbox(cu)
+        conn.commit()
+
+    def _sync_bbox(self, cu):
+        """
+        Add samples missing from the spatial index.
+        """
+        if not (self.spatial and set(COORDINATES).issubset(self._table_columns(cu, 'sample'))):
+            return
+        if not self._table_columns(cu, 'sample_bbox_id'):
+            # An index keyed on `sample.rowid`, as created by earlier versions, is rebuilt:
+            cu.execute("DROP TABLE IF EXISTS sample_bbox")
+            cu.execute(
+                "CREATE TABLE sample_bbox_id (id INTEGER PRIMARY KEY, sample_id TEXT UNIQUE)")
+        cu.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS sample_bbox USING rtree({})".format(
+                ', '.join(['id'] + list(BBOX))))
+        cu.execute("""\
+INSERT INTO sample_bbox_id (sample_id)
+SELECT s.id FROM sample AS s
+WHERE {} IS NOT NULL AND {} IS NOT NULL
+AND s.id NOT IN (SELECT sample_id FROM sample_bbox_id)""".format(BBOX['lat_min'], BBOX['lon_min']))
+        cu.execute("""\
+INSERT INTO sample_bbox ({})
+SELECT b.id, {} FROM sample_bbox_id AS b, sample AS s
+WHERE b.sample_id = s.id AND b.id NOT IN (SELECT id FROM sample_bbox)""".format(
+            ', '.join(['id'] + list(BBOX)), ', '.join(BBOX.values())))
+
+    def _create_indexes(self, cu):
+        tables = {}
+        for table, cols in self.indexes:
+            if table not in tables:
+                tables[table] = self._table_columns(cu, table)
+            if all(col in tables[table] for col in cols):
+                cu.execute("CREATE INDEX IF NOT EXISTS {} ON {} ({})".format(
+                    index_name(table, cols), table, ', '.join('`{}`'.format(c) for c in cols)))
+
+    @staticmethod
+    def _table_columns(cu, table):
+        cu.execute("PRAGMA table_info({})".format(table))
+        return collections.OrderedDict((r[1], r[2]) for r in cu.fetchall())
+
+    @staticmethod
+    def _columns(api, files):
+        from pygeoroc.api import col_type
+
+        cols = {}
+        for f in files:
+            for key in f.columns(api):
+                cols[key] = 'REAL' if col_type(key) is float else 'TEXT'
+        return collections.OrderedDict(sorted(
             cols.items(),
             key=lambda s: ('(' in s[0], bool(re.search('[0-9]', s[0])), s[0])))
 
-        with sqlite3.connect(str(self.fname)) as conn:
-            conn.execute('PRAGMA foreign_keys = ON;')
-            with contextlib.closing(conn.cursor()) as cu:
-                self._create_schema(cu, cols)
-                self._load_data(cu, cols, api, files)
+    def _load(self, cu, cols, api, files, workers, **kw):
+        if workers > 1:
+            with concurrent.futures.ProcessPoolExecutor(
+                    max_workers=workers,
+                    initializer=_init_worker,
+                    initargs=(
+                        api.repos,
+                        timing.get() is not None,
+                        api.cache.path if api.cache else None,
+                        api.archives)) as executor:
+                self._load_data(
+                    cu,
+                    cols,
+                    files,
+                    _imap(
+                        executor,
+                        functools.partial(_parse_file, list(cols)),
+                        files,
+                        2 * workers),
+                    **kw)
+        else:
+            self._load_data(
+                cu,
+                cols,
+                files,
+                map(functools.partial(_parse_file, list(cols), api=api), files),
+                **kw)
 
     def _create_schema(self, cu, cols):
-        cu.execute("CREATE TABLE file (id TEXT PRIMARY KEY, date TEXT, section TEXT);")
+        cu.execute(
+            "CREATE TABLE file (id TEXT PRIMARY KEY, date TEXT, section TEXT, md5 TEXT);")
         cu.execute("CREATE TABLE reference (id INTEGER PRIMARY KEY, reference TEXT);")
         colspec = ['`{}` {}'.format(k, v) for k, v in cols.items()]
         cu.execute("""
@@ -51,32 +419,79 @@ CREATE TABLE citation (
     FOREIGN KEY (reference_id) REFERENCES reference(id)
 );
 """)
+        self._create_duplicate_table(cu)
 
-    def _load_data(self, cu, cols, api, files):
-        refs, samples = set(), set()
-        for f in tqdm(files):
-            cu.execute(
-                "INSERT INTO file (id, date, section) VALUES (?,?,?)",
-                (f.name, f.date, f.section))
-            for id_, ref in f.iter_references(api):
-                if id_ not in refs:
-                    cu.execute(
-                        "INSERT INTO reference (id, reference) VALUES (?,?)",
-                        (id_, ref))
-                    refs.add(id_)
-            tuples, citations = [], []
-            for sample in f.iter_samples(api):
-                if sample.id not in samples:
-                    samples.add(sample.id)
-                    tuples.append(
-                        tuple([sample.id, f.name] + [sample.data.get(c) for c in cols]))
-                    citations.extend(
-                        [(sample.id, cit, ' '.join(fields))
-                         for cit, fields in sample.citations.items()])
-            sql = "INSERT INTO sample ({}) VALUES ({})".format(
-                ', '.join(['id', 'file_id'] + ['`{}`'.format(c) for c in cols]),
-                ', '.join(['?' for _ in range(len(cols) + 2)]))
-            cu.executemany(sql, tuples)
+    @staticmethod
+    def _create_duplicate_table(cu):
+        """
+        The table `sample_duplicate` records samples which have been skipped when loading a file,
+        because they were already loaded from another file.
+        """
+        cu.execute("""
+CREATE TABLE sample_duplicate (
+    sample_id TEXT,
+    file_id TEXT,
+    PRIMARY KEY (sample_id, file_id),
+    FOREIGN KEY (file_id) REFERENCES file(id)
+);
+""")
+
+    def _load_data(self, cu, cols, files, parsed, chunksize=None):
+        """
+        :param parsed: Iterable of the results of `_parse_file`, in the same order as `files`.
+        :param chunksize: If specified, commit after (at least) this number of sample rows.
+        """
+        from tqdm import tqdm
+
+        uncommitted = 0
+        sql = "INSERT OR IGNORE INTO sample ({}) VALUES ({})".format(
+            ', '.join(['id', 'file_id'] + ['`{}`'.format(c) for c in cols]),
+            ', '.join(['?' for _ in range(len(cols) + 2)]))
+        for f, (references, rows, stats) in tqdm(zip(files, parsed), total=len(files)):
+            if stats:
+                timing.get().merge(stats)
+            with timing.stage('sqlite', count=len(rows)):
+                uncommitted += self._insert(cu, sql, f, references, rows)
+                if chunksize and uncommitted >= chunksize:
+                    cu.connection.commit()
+                    uncommitted = 0
+
+    @staticmethod
+    def _insert(cu, sql, f, references, rows):
+        """
+        Insert the data of one file.
+
+        Samples and references which are already in the database are skipped - i.e. the first
+        occurrence wins - by the database, so we only keep track of sample IDs within the file.
+        Skipped samples are recorded in `sample_duplicate`.
+
+        :return: Number of sample rows inserted.
+        """
+        cu.execute(
+            "INSERT INTO file (id, date, section, md5) VALUES (?,?,?,?)",
+            (f.name, f.date, f.section, f.md5))
+        cu.executemany("INSERT OR IGNORE INTO reference (id, reference) VALUES (?,?)", references)
+        seen, tuples, citations = set(), [], []
+        for row, cits in rows:
+            if row[0] not in seen:
+                seen.add(row[0])
+                tuples.append(row)
+                citations.extend(cits)
+        cu.executemany(sql, tuples)
+        inserted = cu.rowcount
+        if inserted == len(tuples):
             cu.executemany(
                 "INSERT INTO citation (sample_id, reference_id, fields) VALUES (?, ?, ?)",
                 citations)
+        else:
+            # Some samples were in the database already. We record these as duplicates and only
+            # insert citations of samples which have been inserted from this file:
+            cu.executemany(
+                "INSERT INTO sample_duplicate (sample_id, file_id) "
+                "SELECT ?, ? WHERE (SELECT file_id FROM sample WHERE id = ?) != ?",
+                [(row[0], f.name, row[0], f.name) for row in tuples])
+            cu.executemany(
+                "INSERT INTO citation (sample_id, reference_id, fields) "
+                "SELECT ?, ?, ? WHERE (SELECT file_id FROM sample WHERE id = ?) = ?",
+                [(sid, rid, fields, sid, f.name) for sid, rid, fields in citations])
+        return inserted
@@ -2,8 +2,13 @@
 This module provides code to fix errata/known problems with the GEOROC data.
 """
 import math
+import typing
 import logging
 import argparse
+import collections
+import collections.abc
+
+from pygeoroc.api import SAMPLE_COLS
 
 _log = None
 
@@ -15,44 +20,196 @@ def log():
     return _log
 
 
+def vectorized(func):
+    """
+    Decorator to register `func` as vectorized version of a converter, i.e. as function
+    converting a `numpy.ndarray` holding the non-empty values of a whole column at once.
+    """
+    def decorator(conv):
+        conv.vectorized = func
+        return conv
+    return decorator
+
+
+def _upper(a):
+    import numpy
+
+    return numpy.char.upper(a.astype(str)).astype(object)
+
+
+@vectorized(_upper)
+def upper(s, *_):
+    return s.upper()
+
+
+def _copysign(sign):
+    def f(a):
+        import numpy
+
+        return numpy.copysign(a, sign)
+    return f
+
+
+@vectorized(_copysign(1))
 def positive(val, *_):
     return math.copysign(val, 1)
 
 
+@vectorized(_copysign(-1))
 def negative(val, *_):
     return math.copysign(val, -1)
 
 
 CONVERTERS = argparse.Namespace(
-    upper=lambda s, *_: s.upper(),
+    upper=upper,
     positive=positive,
     negative=negative,
 )
 
 
-def fix(sample, f, api, stdout=False):
+class _Row(collections.abc.Mapping):
     """
-    :param data: A `dict` representing the data of a row in a GEOROC CSV file.
-    :return: The `dict` with corrected data.
+    A read-only view of one row of the data read with `File.read_columns`, passed to converters
+    as `data` - i.e. with the same keys and values as `SampleData`: Sample columns are left out,
+    missing values are `None` (rather than `NaN`) and floats are Python floats.
     """
-    def _fix(field, converter):
-        new = converter(sample.data[field], sample.data, f.name)
-        if new != sample.data[field]:
-            msg = 'fixing {} in {}: {} -> {}'.format(field, f.name, sample.data[field], new)
+    def __init__(self, columns: dict):
+        self.columns = {k: a for k, a in columns.items() if k not in SAMPLE_COLS}
+        self.index = 0
+
+    def __getitem__(self, key):
+        v = self.columns[key][self.index]
+        if isinstance(v, float):  # Note: `numpy.float64` is a subclass of `float`.
+            return None if math.isnan(v) else float(v)
+        return v
+
+    def __iter__(self):
+        return iter(self.columns)
+
+    def __len__(self):
+        return len(self.columns)
+
+
+class Plan:
+    """
+    The converters applicable to the data of one file, compiled from `api.converters` once,
+    for a given list of columns, i.e. a list of (column index, field, converter) triples.
+
+    Fixes are counted per (field, converter) and reported in aggregate by `Plan.report`.
+    """
+    def __init__(self, fname: str, columns: typing.Sequence[str], steps: list):
+        self.fname = fname
+        self.columns = columns
+        self.steps = steps
+        self.counts = collections.Counter()
+
+    @classmethod
+    def compile(cls, f, api, columns: typing.Sequence[str]) -> 'Plan':
+        index = {c: i for i, c in enumerate(columns)}
+        steps = [
+            (index[field], field, conv) for field, conv in api.converters.FIELDS.items()
+            if field in index]
+        coords = api.converters.COORDINATES.get(f.name)
+        if coords:
+            for i, k in enumerate(columns):
+                prefix = k.split('_')[0].lower()
+                if prefix in coords:
+                    steps.append((i, k, coords[prefix]))
+        return cls(f.name, columns, steps)
+
+    def __bool__(self):
+        return bool(self.steps)
+
+    def apply(self, data):
+        """
+        Fix the data of one sample, i.e. a `pygeoroc.api.SampleData` instance, in place.
+        """
+        if data.header.names is not self.columns:  # The sample does not share the header.
+            for _, field, conv in self.steps:
+                # Steps are applied in sequence, i.e. a step sees the fixes of previous steps:
+                old = data.get(field)
+                if old:
+                    new = conv(old, data, self.fname)
+                    if new != old:
+                        data[field] = new
+                        self.counts[field, conv] += 1
+            return
+
+        cells = data.cells
+        for i, field, conv in self.steps:
+            old = cells[i]
+            if old:
+                new = conv(old, data, self.fname)
+                if new != old:
+                    cells[i] = new
+                    self.counts[field, conv] += 1
+
+    def apply_columns(self, columns: dict):
+        """
+        Fix the data of a file read with `File.read_columns`.
+
+        Converters are applied to all non-empty values of a column at once, if they have a
+        vectorized version (see `vectorized`), otherwise value by value.
+        """
+        import numpy
+
+        for _, field, conv in self.steps:
+            a = columns[field]
+            mask = (~numpy.isnan(a) & (a != 0)) if a.dtype.kind == 'f' else a.astype(bool)
+            if not mask.any():
+                continue
+            old = a[mask]
+            if hasattr(conv, 'vectorized'):
+                new = conv.vectorized(old)
+            else:
+                # The view of a row reflects the fixes of previous steps:
+                row, new = _Row(columns), []
+                for i, v in zip(numpy.flatnonzero(mask).tolist(), old.tolist()):
+                    row.index = i
+                    new.append(conv(v, row, self.fname))
+                new = numpy.array(new, dtype=a.dtype)
+            n = int((new != old).sum())
+            if n:
+                a[mask] = new
+                self.counts[field, conv] += n
+
+    def report(self, stdout=False):
+        """
+        :param stdout: `True` to print the report, `None` to suppress it, `False` to log it.
+        """
+        for (field, conv), n in sorted(self.counts.items(), key=lambda i: i[0][0]):
+            msg = 'fixed {} values of {} in {} with {}'.format(
+                n, field, self.fname, getattr(conv, '__name__', conv))
             if stdout:
-                print(msg)  # pragma: no cover
-            elif stdout is None:  # pragma: no cover
+                print(msg)
+            elif stdout is None:
                 pass
             else:
                 log().info(msg)
-            sample.data[field] = new
+        self.counts.clear()
 
-    for field, conv in api.converters.FIELDS.items():
-        if sample.data.get(field):
-            _fix(field, conv)
 
-    if f.name in api.converters.COORDINATES:
-        for k in sample.data:
-            prefix = k.split('_')[0].lower()
-            if prefix in api.converters.COORDINATES[f.name] and sample.data[k]:
-                _fix(k, api.converters.COORDINATES[f.name][prefix])
+def fix(sample, f, api, stdout=False):
+    """
+    Fix the data of a single sample.
+
+    Note: When fixing all samples of a file, compiling a `Plan` once is more efficient.
+
+    :param sample: A `Sample` instance, whose data is corrected in place.
+    """
+    plan = Plan.compile(f, api, sample.data.header.names)
+    plan.apply(sample.data)
+    plan.report(stdout=stdout)
+
+
+def fix_columns(columns, f, api):
+    """
+    Apply the converters to the data of a file read with `File.read_columns`.
+
+    :param columns: `dict` mapping column names to `numpy.ndarray`s.
+    :return: The `dict` with corrected data.
+    """
+    plan = Plan.compile(f, api, list(columns))
+    plan.apply_columns(columns)
+    plan.report()
+    return columns
@@ -0,0 +1,137 @@
+"""
+Export GEOROC data to columnar files, using Apache Arrow.
+
+The export mirrors the tables of the SQLite database created with `pygeoroc.db.Database`:
+`file` and `reference` are written to one file each, `sample` and `citation` are partitioned
+by `file.section`, using Hive-style directory names, e.g.
+`sample/section=GEOROC%20Compilation%3A%20Archaean%20Cratons/part-0.parquet`, as understood
+by `pyarrow.dataset.dataset(..., partitioning='hive')`.
+"""
+import pathlib
+import collections
+import urllib.parse
+
+FORMATS = {'parquet': 'parquet', 'arrow': 'arrow'}  # Map format names to file extensions.
+# Number of rows buffered before a record batch is written:
+BATCH_SIZE = 10000
+
+
+class Table:
+    """
+    A table written in batches to one file (per partition).
+    """
+    def __init__(self, path: pathlib.Path, schema, fmt: str, batch_size: int = BATCH_SIZE):
+        self.path = path
+        self.schema = schema
+        self.format = fmt
+        self.batch_size = batch_size
+        self.rows = []
+        self.writer = None
+
+    def append(self, row: tuple):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        import pyarrow
+
+        if self.writer is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            if self.format == 'parquet':
+                import pyarrow.parquet
+
+                self.writer = pyarrow.parquet.ParquetWriter(str(self.path), self.schema)
+            else:
+                self.writer = pyarrow.ipc.new_file(str(self.path), self.schema)
+        self.writer.write_table(pyarrow.Table.from_arrays(
+            [pyarrow.array(col, type=field.type)
+             for col, field in zip(zip(*self.rows) if self.rows else [[]] * len(self.schema),
+                                   self.schema)],
+            schema=self.schema))
+        self.rows = []
+
+    def close(self):
+        if self.rows or self.writer is None:
+            self.flush()
+        self.writer.close()
+
+
+class Exporter:
+    def __init__(self, outdir: pathlib.Path, fmt: str = 'parquet', batch_size: int = BATCH_SIZE):
+        assert fmt in FORMATS
+        self.outdir = outdir
+        self.format = fmt
+        self.batch_size = batch_size
+
+    def _table(self, schema, name, section=None):
+        comps = [name]
+        if section is not None:
+            comps.append('section={}'.format(urllib.parse.quote(section, safe='')))
+        comps.append('{}.{}'.format(
+            'part-0' if section is not None else name, FORMATS[self.format]))
+        return Table(self.outdir.joinpath(*comps), schema, self.format, self.batch_size)
+
+    def export(self, api):
+        """
+        Samples are read file by file and written in batches, thus memory use does not grow
+        with the size of the corpus. Duplicate samples are skipped (the first occurrence wins,
+        as for `GEOROC.iter_samples`), keeping track of sample IDs in a `SeenSet`.
+        """
+        import pyarrow
+        from pygeoroc.api import col_type, SeenSet
+
+        files = list(api.iter_files())
+        cols = collections.OrderedDict()
+        for f in files:
+            for key in f.columns(api):
+                cols[key] = pyarrow.float64() if col_type(key) is float else pyarrow.string()
+
+        table = self._table(
+            pyarrow.schema([
+                ('id', pyarrow.string()),
+                ('date', pyarrow.string()),
+                ('section', pyarrow.string()),
+                ('md5', pyarrow.string())]),
+            'file')
+        for f in files:
+            table.append((f.name, f.date, f.section, f.md5))
+        table.close()
+
+        references = self._table(
+            pyarrow.schema([('id', pyarrow.int64()), ('reference', pyarrow.string())]),
+            'reference')
+        sample_schema = pyarrow.schema(
+            [('id', pyarrow.string()), ('file_id', pyarrow.string())] +  # noqa: W504
+            [(k, v) for k, v in cols.items()])
+        citation_schema = pyarrow.schema([
+            ('sample_id', pyarrow.string()),
+            ('reference_id', pyarrow.int64()),
+            ('fields', pyarrow.string())])
+        sids, refs = SeenSet(), set()
+        section, samples, citations = None, None, None
+        for f in files:
+            if f.section != section:
+                # Files are ordered by dataset, i.e. by section, so we only have one partition
+                # open at a time.
+                for table in [samples, citations]:
+                    if table:
+                        table.close()
+                section = f.section
+                samples = self._table(sample_schema, 'sample', section)
+                citations = self._table(citation_schema, 'citation', section)
+            # Read samples and references in one pass over the file:
+            reader = f.reader(api)
+            for sample in reader.iter_samples():
+                if sids.add(sample.id):
+                    samples.append(tuple([sample.id, f.name] + [sample.data.get(c) for c in cols]))
+                    for cit, fields in sample.citations.items():
+                        citations.append((sample.id, int(cit), ' '.join(fields)))
+            for id_, ref in reader.references:
+                if id_ not in refs:
+                    refs.add(id_)
+                    references.append((id_, ref))
+        for table in [samples, citations, references]:
+            if table:
+                table.close()
+        sids.close()
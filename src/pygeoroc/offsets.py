@@ -0,0 +1,161 @@
+"""
+Per-file indexes of the byte offsets of rows in GEOROC CSV files, keyed by `UNIQUE_ID`, providing
+random access to samples.
+
+An index is built in one pass over a file and stored as JSON in `<repos>/offsets/`. It records the
+`md5` of the file it was built for, and is rebuilt if the file has changed.
+
+Files - or members of zip archives (see `File.location`) - are read in chunks to build the
+index. Rows are read from memory-mapped files, or by seeking in the decompressed stream of an
+archive member. Note that seeking in a
+compressed member means decompressing it up to the requested row, i.e. in archive mode, looking
+up samples costs time proportional to the size of the file rather than milliseconds.
+"""
+import re
+import csv
+import mmap
+import typing
+import pathlib
+import zipfile
+import functools
+import contextlib
+
+from clldutils.jsonlib import dump, load
+
+from pygeoroc.api import File, Sample, SampleData, Columns, column_name, SAMPLE_COLS, CHUNK_SIZE
+
+__all__ = ['OffsetIndex']
+
+# Lines may be terminated by CR, LF or CRLF:
+LINE = re.compile(rb'[^\r\n]+')
+
+
+def _iter_lines(fp) -> typing.Generator[typing.Tuple[int, bytes], None, None]:
+    """
+    Read lines from a binary stream in chunks, keeping track of their byte offsets.
+
+    :return: Generator of pairs `(offset, line)`.
+    """
+    pos, rest = 0, b''
+    for chunk in iter(functools.partial(fp.read, CHUNK_SIZE), b''):
+        buf = rest + chunk
+        # Only the lines before the last line break in the buffer are complete:
+        end = max(buf.rfind(b'\r'), buf.rfind(b'\n')) + 1
+        for m in LINE.finditer(buf, 0, end):
+            yield pos + m.start(), m.group()
+        pos, rest = pos + end, buf[end:]
+    for m in LINE.finditer(rest):
+        yield pos + m.start(), m.group()
+
+
+def _parse(line: bytes) -> typing.List[str]:
+    return next(csv.reader([line.decode('cp1252').strip()]))
+
+
+@contextlib.contextmanager
+def _reader(path: pathlib.Path, member: typing.Optional[str] = None):
+    """
+    :return: Context manager providing a function `read(offset, length)` to read bytes.
+    """
+    if member is None:
+        with path.open('rb') as fp:
+            with contextlib.closing(mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)) as mm:
+                yield lambda off, n: mm[off:off + n]
+    else:
+        with zipfile.ZipFile(str(path)) as z:
+            with z.open(member) as fp:
+                def read(off, n):
+                    fp.seek(off)
+                    return fp.read(n)
+
+                yield read
+
+
+class OffsetIndex:
+    def __init__(self, f: File, location, header, rows: dict):
+        """
+        :param location: Location of the file, as returned by `File.location`.
+        :param header: Pair (offset, length) of the header line.
+        :param rows: `dict` mapping sample IDs to pairs (offset, length) of the row.
+        """
+        self.file = f
+        self.location = location
+        self.rows = rows
+        self._header = header
+        self._layout = None
+
+    def __contains__(self, sid):
+        return sid in self.rows
+
+    @classmethod
+    def load(cls, f: File, api) -> 'OffsetIndex':
+        """
+        Load the index for a file, (re)building it if necessary.
+        """
+        p = api.path('offsets', '{}.json'.format(f.name))
+        if p.exists():
+            d = load(p)
+            if d['md5'] == f.md5:
+                return cls(f, f.location(api), d['header'], d['rows'])
+        return cls.build(f, api, p)
+
+    @classmethod
+    def build(cls, f: File, api, p: pathlib.Path) -> 'OffsetIndex':
+        location = f.location(api)
+        header, rows, sid = None, {}, None
+        with contextlib.ExitStack() as stack:
+            path, member = location
+            if member is None:
+                fp = stack.enter_context(path.open('rb'))
+            else:
+                # Stream the decompressed member, rather than reading it into memory:
+                fp = stack.enter_context(
+                    stack.enter_context(zipfile.ZipFile(str(path))).open(member))
+            for offset, line in _iter_lines(fp):
+                if not line.strip():
+                    continue  # pragma: no cover
+                if line.startswith(b'Abbreviations') or line.startswith(b'References:'):
+                    break
+                span = [offset, len(line)]
+                if header is None:
+                    header = span
+                    sid = [column_name(k) for k in _parse(line)].index('UNIQUE_ID')
+                    continue
+                # The first occurrence of a sample in a file wins, as for `iter_samples`:
+                rows.setdefault(_parse(line)[sid], span)
+        p.parent.mkdir(exist_ok=True)
+        dump(dict(md5=f.md5, header=header, rows=rows), p)
+        return cls(f, location, header, rows)
+
+    def _get_layout(self, read):
+        if self._layout is None:
+            keys = [column_name(k) for k in _parse(read(*self._header))]
+            positions = [i for i, k in enumerate(keys) if k not in SAMPLE_COLS]
+            self._layout = (
+                [keys.index(k) for k in SAMPLE_COLS],
+                positions,
+                Columns(keys[i] for i in positions))
+        return self._layout
+
+    def get_samples(self, api, sids: typing.Iterable[str]) -> typing.Generator[Sample, None, None]:
+        """
+        Read the samples with the given IDs from the file - parsing only their rows - and fix
+        them with `errata.fix`.
+
+        Note: Samples are read in the order of their rows in the file, so that reading from \
+        archives only requires seeking forward - i.e. decompressing the member once, up to the \
+        last requested row.
+        """
+        from pygeoroc import errata
+
+        with _reader(*self.location) as read:
+            (id_, name, citations), positions, header = self._get_layout(read)
+            for sid in sorted(sids, key=lambda i: self.rows[i][0]):
+                row = _parse(read(*self.rows[sid]))
+                sample = Sample(
+                    id=row[id_],
+                    name=row[name],
+                    citations=row[citations],
+                    data=SampleData(header, [row[j] for j in positions]))
+                errata.fix(sample, self.file, api, stdout=None)
+                yield sample
@@ -0,0 +1,141 @@
+"""
+Instrumentation to measure the time spent in the stages of reading and loading GEOROC data,
+i.e. reading and decoding lines, CSV parsing, `Sample` construction, errata fixing and
+database inserts.
+
+Instrumentation is off by default, in which case `timed` returns iterables unchanged and `stage`
+returns a no-op context manager. It is turned on by `enable`, e.g. by the `--timings` option of
+the `georoc` command.
+"""
+import time
+import typing
+import contextlib
+import collections
+
+__all__ = ['Timings', 'enable', 'disable', 'get', 'timed', 'stage']
+
+_timings = None
+
+
+class Timings:
+    """
+    Times are "exclusive", i.e. time spent in a nested stage is not counted for the enclosing
+    stage. So stages can be wrapped around each other's iterators, e.g.
+
+    .. code-block:: python
+
+        timed('csv', csv.reader(timed('decode', lines)))
+    """
+    def __init__(self):
+        self.stages = collections.OrderedDict()
+        self.files = collections.OrderedDict()
+        self._stack = []
+        self._start = time.perf_counter()
+
+    def _push(self):
+        self._stack.append(0.0)
+        return time.perf_counter()
+
+    def _pop(self, name, start, count=0, file=None):
+        elapsed = time.perf_counter() - start
+        children = self._stack.pop()
+        if self._stack:
+            self._stack[-1] += elapsed
+        s = self.stages.setdefault(name, dict(seconds=0.0, count=0))
+        s['seconds'] += elapsed - children
+        s['count'] += count
+        if file:
+            f = self.files.setdefault(file, dict(seconds=0.0, rows=0))
+            f['seconds'] += elapsed
+            f['rows'] += count
+
+    def iter(self, name: str, iterable: typing.Iterable, file=None) -> typing.Iterator:
+        """
+        Time spent computing the items of `iterable`.
+
+        :param file: Name of a file to which to attribute items and (inclusive) time.
+        """
+        it = iter(iterable)
+        while True:
+            start = self._push()
+            try:
+                item = next(it)
+            except StopIteration:
+                self._pop(name, start, file=file)
+                return
+            self._pop(name, start, count=1, file=file)
+            yield item
+
+    @contextlib.contextmanager
+    def stage(self, name: str, count: int = 0):
+        start = self._push()
+        try:
+            yield
+        finally:
+            self._pop(name, start, count=count)
+
+    def merge(self, other: dict):
+        """
+        Merge timings - e.g. collected in a worker process - serialized with `as_json`.
+        """
+        for attr in ['stages', 'files']:
+            for name, d in other[attr].items():
+                target = getattr(self, attr).setdefault(name, {k: 0 for k in d})
+                for k, v in d.items():
+                    if not k.endswith('per_second'):
+                        target[k] += v
+
+    def as_json(self) -> dict:
+        def per_second(n, seconds):
+            return round(n / seconds, 1) if seconds else None
+
+        return collections.OrderedDict([
+            ('total', round(time.perf_counter() - self._start, 4)),
+            ('stages', collections.OrderedDict(
+                (k, dict(
+                    seconds=round(v['seconds'], 4),
+                    count=v['count'],
+                    per_second=per_second(v['count'], v['seconds'])))
+                for k, v in self.stages.items())),
+            ('files', collections.OrderedDict(
+                (k, dict(
+                    seconds=round(v['seconds'], 4),
+                    rows=v['rows'],
+                    rows_per_second=per_second(v['rows'], v['seconds'])))
+                for k, v in self.files.items())),
+        ])
+
+    def reset(self) -> dict:
+        res = self.as_json()
+        self.__init__()
+        return res
+
+    def report(self, log):
+        res = self.as_json()
+        log.info('total: {:.2f}s'.format(res['total']))
+        for name, s in res['stages'].items():
+            log.info('{}: {:.2f}s, {} items, {} items/s'.format(
+                name, s['seconds'], s['count'], s['per_second']))
+
+
+def enable() -> Timings:
+    global _timings
+    _timings = Timings()
+    return _timings
+
+
+def disable():
+    global _timings
+    _timings = None
+
+
+def get() -> typing.Optional[Timings]:
+    return _timings
+
+
+def timed(name: str, iterable: typing.Iterable, file=None) -> typing.Iterable:
+    return iterable if _timings is None else _timings.iter(name, iterable, file=file)
+
+
+def stage(name: str, count: int = 0):
+    return contextlib.nullcontext() if _timings is None else _timings.stage(name, count=count)
@@ -1,8 +1,41 @@
+import io
+import argparse
+import zipfile
+
+import pytest
+
+import pygeoroc.api
+import pygeoroc.offsets
+from pygeoroc import GEOROC
+from pygeoroc.api import Sample
+
 
 def test_dataset(api):
     assert 'DIGIS' in api.index[0].citation
 
 
+def test_index(api):
+    p = api.path('datasets.json')
+    mtime = p.stat().st_mtime_ns
+    index = api.index
+    assert api.index is index and index[0].files is index[0].files
+    assert p.stat().st_mtime_ns == mtime, 'Reading the index must not rewrite datasets.json'
+
+    f = index[0].files[0]
+    assert api.get_file(f.name) is f
+    assert api.get_dataset(f.name) is index[0]
+    with pytest.raises(KeyError):
+        api.get_file('x.csv')
+
+    # The index is reloaded if datasets.json changes:
+    api.index = [index[0].md, index[0].md]
+    assert len(api.index) == 2
+    p.write_text('[]', encoding='utf8')
+    assert api.index == []
+    p.unlink()
+    assert api.index == []
+
+
 def test_samples(api):
     samples = list(api.iter_samples())
     assert len(samples) == 426
@@ -13,3 +46,226 @@ def test_samples(api):
 
 def test_references(api):
     assert len(list(api.iter_references())) == 27
+
+
+def test_columns(api):
+    f = next(api.iter_files())
+    sample = next(f.iter_samples(api))
+    assert sorted(f.columns(api)) == sorted(k for k in sample.data if k)
+    assert f.md5 in api.columns_cache
+
+
+def test_Sample(api):
+    samples = [s for s, _ in api.iter_samples()]
+    assert samples[0].data.header is samples[1].data.header
+
+    sample = Sample.from_row(
+        {'UNIQUE_ID': '1', 'SAMPLE NAME': 'x', 'CITATIONS': '[1]', 'LATITUDE_(MIN.)': '1.5 [1]'})
+    assert sample.data == {'LATITUDE_MIN': 1.5}
+    assert sample.citations == {'1': ['LATITUDE_MIN']}
+    assert 'LATITUDE_MIN' in repr(sample)
+    sample.data['LOCATION'] = 'x'
+    assert sample.region == 'x'
+    with pytest.raises(TypeError):
+        del sample.data['LOCATION']
+
+
+def test_read_columns(api):
+    numpy = pytest.importorskip('numpy')
+
+    f = next(api.iter_files())
+    cols = f.read_columns(api)
+    samples = list(f.iter_samples(api))
+    assert list(cols['UNIQUE_ID']) == [s.id for s in samples]
+    for k in ['LATITUDE_MIN', 'ELEVATION_MAX', 'SIO2(WT%)', 'LOCATION', 'LAND_OR_SEA']:
+        assert [None if v is None or v != v else v for v in cols[k].tolist()] == \
+            [s.data[k] for s in samples]
+    assert cols['SIO2(WT%)'].dtype == numpy.float64
+
+    cols = api.read_columns()
+    assert len(cols['file']) == len(list(api.iter_samples()))
+
+    # Reading columns does not depend on the parse cache:
+    cached = GEOROC(api.repos, cache=True)
+    list(cached.iter_samples())
+    assert list(cached.read_columns()['UNIQUE_ID']) == list(cols['UNIQUE_ID'])
+    assert list(f.read_columns(cached)['UNIQUE_ID']) == [s.id for s in samples]
+
+
+def test_checksums(api, mocker):
+    md5 = mocker.spy(pygeoroc.api, 'md5')
+    f = next(api.iter_files())
+    assert f.exists(api)
+    api.checksums.save()
+    assert api.path('checksums.json').exists()
+
+    # A new API instance reads the checksum from the cache:
+    api = GEOROC(api.repos)
+    api.checksums.update([api.csvdir / f.name, api.csvdir / 'nonexisting.csv'])
+    assert f.exists(api) and md5.call_count == 1
+
+    # Changing the file invalidates the cache entry:
+    p = api.csvdir / f.name
+    p.write_bytes(p.read_bytes() + b'x')
+    assert not f.exists(api) and md5.call_count == 2
+
+
+def test_FileReader(api, mocker):
+    f = next(api.iter_files())
+    iter_lines = mocker.spy(f, 'iter_lines')
+    reader = f.reader(api)
+    assert len(list(reader.iter_samples())) == 426
+    assert len(reader.references) == 27
+    assert iter_lines.call_count == 1
+
+    # Accessing references first skips the samples:
+    reader = f.reader(api)
+    assert len(reader.references) == 27
+    assert not list(reader.iter_samples())
+
+
+def test_FileReader_references(tmp_path):
+    # The trailer may start with the references, rather than the abbreviations:
+    tmp_path.joinpath('test.csv').write_bytes(b'"A"\r\n"1"\r\nReferences: \r\n[12] a\r\n')
+    f = pygeoroc.api.File(dict(
+        filename='test.csv', creationDate='', md5='', filesize=0, persistentId=''))
+    reader = pygeoroc.api.FileReader(f, argparse.Namespace(csvdir=tmp_path, archives=False))
+    assert len(list(reader.iter_rows())) == 2
+    assert reader.references == [(12, 'a')]
+
+
+def test_iter_samples_filtered(api, mocker):
+    cols = ['LATITUDE_MIN', 'LAND_OR_SEA', 'SIO2(WT%)']
+    full = [s for s, _ in api.iter_samples()]
+    expected = [(s.id, [s.data.get(c) for c in cols]) for s in full if s.data['ROCK_TYPE'] == 'PLU']
+    assert expected
+
+    res = list(api.iter_samples(columns=cols, where={'ROCK_TYPE': 'PLU'}))
+    assert [(s.id, [s.data.get(c) for c in cols]) for s, _ in res] == expected
+    assert set(res[0][0].data) == set(cols + ['ROCK_TYPE'])
+    assert res[0][0].data['LAND_OR_SEA'] == 'SAE'  # Errata have been applied.
+
+    res = api.iter_samples(where={'SIO2(WT%)': lambda v: v is not None and v > 60})
+    assert {s.id for s, _ in res} == {s.id for s in full if (s.data['SIO2(WT%)'] or 0) > 60}
+    res = api.iter_samples(columns=[], where=lambda data: not data)
+    assert len(list(res)) == len(full)
+
+    # Cached samples are filtered the same way:
+    cached = GEOROC(api.repos, cache=True)
+    for _ in range(2):
+        res = list(cached.iter_samples(columns=cols, where={'ROCK_TYPE': 'PLU'}))
+        assert [(s.id, [s.data.get(c) for c in cols]) for s, _ in res] == expected
+    assert len(list(cached.iter_samples(columns=cols))) == len(full)
+
+    with pygeoroc.api.SeenSet() as seen:
+        assert len(list(pygeoroc.api.project(full + full, seen=seen))) == len(full)
+
+    # Excluded files are not opened:
+    mocker.patch('pygeoroc.api.File.reader', side_effect=ValueError)
+    assert list(api.iter_samples(files=['x.csv'])) == []
+    assert list(api.iter_samples(sections=['x'])) == []
+
+
+def test_get_samples(api, mocker):
+    full = [s for s, _ in api.iter_samples()]
+    ids = [full[-1].id, 'x', full[0].id, full[100].id]
+    res = api.get_samples(ids)
+    assert list(res) == [ids[0], ids[2], ids[3]]
+    for s in [full[-1], full[0], full[100]]:
+        assert res[s.id].name == s.name
+        assert res[s.id].citations == s.citations
+        assert dict(res[s.id].data) == dict(s.data)  # Errata have been applied.
+    with pytest.raises(KeyError):
+        api.get_sample('x')
+
+    # The index is persisted - and rebuilt if the file changes:
+    f = next(api.iter_files())
+    assert api.path('offsets', '{}.json'.format(f.name)).exists()
+    build = mocker.spy(pygeoroc.offsets.OffsetIndex, 'build')
+    assert GEOROC(api.repos).get_sample(full[0].id).name == full[0].name
+    assert build.call_count == 0
+    api = GEOROC(api.repos)
+    next(api.iter_files()).md5 = 'x'
+    assert api.get_sample(full[0].id).name == full[0].name
+    assert build.call_count == 1
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 5, 1024])
+def test_iter_lines(mocker, chunk_size):
+    content = b'ab\r\ncd\r\r\nefg\nh\ri'
+    mocker.patch('pygeoroc.offsets.CHUNK_SIZE', chunk_size)
+    assert list(pygeoroc.offsets._iter_lines(io.BytesIO(content))) == \
+        [(m.start(), m.group()) for m in pygeoroc.offsets.LINE.finditer(content)]
+
+
+def test_counts(api, mocker):
+    f = next(api.iter_files())
+    assert f.count_samples(api) == len(list(f.reader(api).iter_samples())) == 426
+    assert f.count_references(api) == len(f.reader(api).references) == 27
+    assert not api.path('counts.json').exists()
+    api.counts.save()
+
+    scan = mocker.patch('pygeoroc.api.scan_counts')
+    assert GEOROC(api.repos).counts.get(f, api) == (426, 27)
+    GEOROC(api.repos).counts.update(api, [f])
+    assert scan.call_count == 0
+
+
+def test_counts_outdated(api):
+    f = next(api.iter_files())
+    with api.csvdir.joinpath(f.name).open('ab') as fp:
+        fp.write(b'\r')
+    assert not f.exists(api)
+    # Counts for a file not matching its checksum in the index are not cached:
+    assert api.counts.get(f, api) == (426, 27)
+    api.counts.update(api, [f])
+    assert f.md5 not in GEOROC(api.repos).counts._data
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_counts_update(api, workers):
+    f = next(api.iter_files())
+    api.counts.update(api, [f], workers=workers)
+    # Checksums are computed along with the counts, and saved:
+    api = GEOROC(api.repos)
+    assert f.md5 in api.counts._data
+    assert api.checksums.cached(api.csvdir / f.name) == f.md5
+
+
+def test_counts_update_archives(api):
+    f = next(api.iter_files())
+    api.archivedir.mkdir()
+    with zipfile.ZipFile(str(api.archivedir / f.archive), 'w') as z:
+        z.write(str(api.csvdir / f.name), f.name)
+    missing = pygeoroc.api.File(dict(f.md, filename='missing.csv', md5='x'), archive=f.archive)
+    api = GEOROC(api.repos, archives=True)
+    api.counts.update(api, [f, missing], workers=1)
+    assert api.counts._data == {f.md5: [426, 27]}
+    assert api.checksums.cached(api.archivedir / f.archive, member=f.name) == f.md5
+
+
+@pytest.mark.parametrize(
+    'content,expected',
+    [
+        (b'', (0, 0)),
+        (b'"A"', (0, 0)),
+        (b'"A"\n  "1"\n\t\n"2"', (2, 0)),
+        (b'"A","B"\r"1","2"\r\r  \r"3","4"\r', (2, 0)),
+        (b'"A"\n"1"\nAbbreviations:\nx\n\nReferences:\n"[1] a"\n[2]  b \nc\n', (1, 2)),
+        (b'"A"\r\n"1"\r\nReferences: \r\n[12] a\r\n', (1, 1)),
+        (b'"A"\r"1 Abbreviations"\r \tReferences:\r[1] a\r', (1, 1)),
+    ]
+)
+def test_scan_counts(tmp_path, content, expected):
+    p = tmp_path / 'test.csv'
+    p.write_bytes(content)
+    assert pygeoroc.api.scan_counts(p) == expected
+    with zipfile.ZipFile(str(tmp_path / 'test.zip'), 'w') as z:
+        z.write(str(p), 'test.csv')
+    assert pygeoroc.api.scan_counts(tmp_path / 'test.zip', 'test.csv') == expected
+    if content:
+        f = pygeoroc.api.File(dict(
+            filename='test.csv', creationDate='', md5='', filesize=0, persistentId=''))
+        api = argparse.Namespace(csvdir=tmp_path, archives=False)
+        reader = pygeoroc.api.FileReader(f, api)
+        assert [len(list(reader.iter_rows())) - 1, len(reader.references)] == list(expected)
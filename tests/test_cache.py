@@ -0,0 +1,47 @@
+import pytest
+
+from pygeoroc import GEOROC
+from pygeoroc.cache import iter_records, MAGIC, REFERENCES
+
+
+@pytest.fixture
+def cached(repos, tmp_path):
+    return GEOROC(repos, cache=tmp_path / 'cache')
+
+
+def test_Cache(api, cached, mocker):
+    f = next(api.iter_files())
+    expected = [(s.id, s.name, s.citations, dict(s.data)) for s in f.iter_samples(api)]
+
+    # Abandoning iteration does not leave a cache file behind:
+    next(f.iter_samples(cached))
+    assert not list(cached.cache.path.iterdir())
+
+    for _ in range(2):
+        assert [(s.id, s.name, s.citations, dict(s.data))
+                for s in f.iter_samples(cached)] == expected
+    assert len(list(cached.cache.path.iterdir())) == 1
+
+    # Reading from the cache skips parsing the CSV file:
+    mocker.patch('pygeoroc.cache.FileReader', side_effect=ValueError)
+    assert list(f.iter_references(cached)) == list(f.iter_references(api))
+    assert [k for k, _ in iter_records(cached.cache.path_for(f), kinds={REFERENCES})] == \
+        [REFERENCES]
+
+    # Changes to the converters invalidate the cache:
+    cached.path('converters.py').write_text('FIELDS = {}\nCOORDINATES = {}\n', encoding='utf8')
+    mocker.stopall()
+    refs = list(f.iter_references(api))
+    api = GEOROC(api.repos, cache=cached.cache.path)
+    assert api.cache.key != cached.cache.key
+    assert list(f.iter_references(api)) == refs
+    assert [p.name for p in api.cache.path.iterdir()] == [api.cache.path_for(f).name]
+
+
+def test_iter_records(tmp_path):
+    p = tmp_path / 'test.cache'
+    p.write_bytes(MAGIC)
+    assert list(iter_records(p)) == []
+    p.write_bytes(b'abc' * 10)
+    with pytest.raises(ValueError):
+        list(iter_records(p))
@@ -1,4 +1,5 @@
 import json
+import shutil
 import logging
 import pathlib
 import zipfile
@@ -6,6 +7,8 @@ import zipfile
 import pytest
 from clldutils.jsonlib import load
 
+from pygeoroc import GEOROC
+from pygeoroc.api import Dataset, File
 from pygeoroc.__main__ import main
 
 
@@ -16,8 +19,9 @@ def _main(repos):
     return f
 
 
-def test_download(_main, caplog, repos, tmp_path):
+def test_download(_main, caplog, repos, tmp_path, mocker):
     import requests_mock
+    import pygeoroc.api
 
     def content_callback(request, context):
         if 'access' in request.url:  # file download
@@ -38,10 +42,59 @@ def test_download(_main, caplog, repos, tmp_path):
         for p in repos.joinpath('csv').iterdir():
             p.unlink()
 
-        _main('download')
+        _main('download', '--workers', '1')
         assert len(caplog.records) == 12
+        checksums = mocker.spy(pygeoroc.api.Checksums, '__init__')
         _main('download')
         assert len(caplog.records) == 22
+        # The checksum cache is shared by all worker threads:
+        assert checksums.call_count == 1
+
+
+def test_download_files(repos, tmp_path):
+    import requests_mock
+
+    # A dataset with three files, one of which is missing and partially downloaded:
+    csv = repos / 'csv' / '2022-06-1KRR1P_ZIMBABWE_CRATON_ARCHEAN.csv'
+    md = load(repos / 'datasets.json')[0]
+    files = md['latestVersion']['files']
+    for i in range(1, 3):
+        f = json.loads(json.dumps(files[0]))
+        f['dataFile']['filename'] = '{}.csv'.format(i)
+        f['dataFile']['persistentId'] = 'doi:x/{}'.format(i)
+        files.append(f)
+    repos.joinpath('csv', '1.csv').write_bytes(csv.read_bytes())
+    repos.joinpath('csv', '2.csv.part').write_bytes(csv.read_bytes()[:1000])
+    ranges = []
+
+    def content_callback(request, context):
+        assert 'persistentId=doi:x/2' in request.url
+        ranges.append(request.headers.get('Range'))
+        context.status_code = 206
+        return csv.read_bytes()[1000:]
+
+    api = GEOROC(repos)
+    with requests_mock.Mocker() as mock:
+        mock.get(requests_mock.ANY, content=content_callback)
+        Dataset(md).download_files(api, log=logging.getLogger(__name__))
+    assert ranges == ['bytes=1000-']
+    assert repos.joinpath('csv', '2.csv').read_bytes() == csv.read_bytes()
+    assert not repos.joinpath('csv', '2.csv.part').exists()
+
+    # A complete part file - left behind by an interrupted run - is verified as it is:
+    repos.joinpath('csv', '2.csv').replace(repos.joinpath('csv', '2.csv.part'))
+    with requests_mock.Mocker() as mock:
+        mock.get(requests_mock.ANY, status_code=416)
+        Dataset(md).download_files(api)
+    assert repos.joinpath('csv', '2.csv').read_bytes() == csv.read_bytes()
+
+    # Corrupt downloads are detected:
+    repos.joinpath('csv', '2.csv').unlink()
+    with requests_mock.Mocker() as mock:
+        mock.get(requests_mock.ANY, content=b'abc')
+        with pytest.raises(ValueError):
+            Dataset(md).download_files(api)
+    assert not repos.joinpath('csv', '2.csv.part').exists()
 
 
 def test_createdb(_main, api, tmpdir, capsys):
@@ -57,10 +110,119 @@ def test_createdb(_main, api, tmpdir, capsys):
     _main('stats')
 
 
-def test_ls(_main, capsys):
-    _main('ls', '--samples', '--references')
+def test_createdb_workers(_main, api):
+    _main('createdb')
+    sql = 'SELECT * FROM {} ORDER BY rowid'
+    expected = {t: api.dbquery(sql.format(t)) for t in ['file', 'reference', 'sample', 'citation']}
+    _main('createdb', '--force', '--workers', '2')
+    for table, rows in expected.items():
+        assert api.dbquery(sql.format(table)) == rows
+
+
+def test_createdb_fast(_main, api, mocker):
+    mocker.patch('pygeoroc.db.CHUNKSIZE', 100)
+    sql = 'SELECT * FROM {} ORDER BY rowid'
+    tables = ['file', 'reference', 'sample', 'citation']
+    _main('createdb')
+    schema = api.dbquery("SELECT sql FROM sqlite_master WHERE name NOT LIKE 'sqlite_%'")
+    expected = {t: api.dbquery(sql.format(t)) for t in tables}
+    _main('createdb', '--force', '--fast')
+    assert api.dbquery(
+        "SELECT sql FROM sqlite_master WHERE name NOT LIKE 'sqlite_%'") == schema
+    for table, rows in expected.items():
+        assert api.dbquery(sql.format(table)) == rows
+    _main('createdb', '--update', '--fast')
+
+
+def test_createdb_update_fast_rollback(_main, api, mocker):
+    import copy
+    import sqlite3
+    import pygeoroc.db
+
+    md = api.index[0].md
+    f = copy.deepcopy(md['latestVersion']['files'][0])
+    shutil.copy(api.csvdir / f['dataFile']['filename'], api.csvdir / 'copy.csv')
+    f['dataFile']['filename'] = 'copy.csv'
+    md['latestVersion']['files'].append(f)
+    api.index = [md]
+    _main('createdb')
+    sql = {t: 'SELECT * FROM {} ORDER BY 1, 2'.format(t)
+           for t in ['file', 'sample', 'citation', 'sample_duplicate']}
+    with sqlite3.connect(str(api.dbpath)) as conn:
+        conn.execute("UPDATE file SET md5 = 'x'")
+    expected = {t: api.dbquery(q) for t, q in sql.items()}
+
+    # A failure when reloading changed files rolls back the update - including deletions and
+    # files loaded before the failure:
+    parse = pygeoroc.db._parse_file
+
+    def fail(cols, f, api=None):
+        if f.name == 'copy.csv':
+            raise ValueError(f.name)
+        return parse(cols, f, api=api)
+
+    mocker.patch('pygeoroc.db.CHUNKSIZE', 1)
+    mocker.patch('pygeoroc.db._parse_file', fail)
+    with pytest.raises(ValueError):
+        _main('createdb', '--update', '--fast')
+    for t, q in sql.items():
+        assert api.dbquery(q) == expected[t]
+
+
+def test_createdb_update(_main, api, caplog):
+    import sqlite3
+
+    caplog.set_level(logging.INFO)
+    _main('createdb')
+    sql = 'SELECT * FROM sample ORDER BY id'
+    expected = api.dbquery(sql)
+    citations = api.dbquery('SELECT count(*) AS n FROM citation')
+    _main('createdb', '--update')
+    assert '0 new or changed files' in caplog.text
+
+    # Simulate a changed file and a column which is new since the last build:
+    with sqlite3.connect(str(api.dbpath)) as conn:
+        conn.execute("UPDATE file SET md5 = 'x'")
+        conn.execute("ALTER TABLE file DROP COLUMN md5")
+        conn.execute("ALTER TABLE sample DROP COLUMN `SIO2(WT%)`")
+    _main('createdb', '--update')
+    assert '1 new or changed files' in caplog.text
+    assert [dict(r) for r in api.dbquery(sql)] == [dict(r) for r in expected]
+    assert api.dbquery('SELECT count(*) AS n FROM citation') == citations
+
+    # A database created before duplicates were recorded is reloaded completely:
+    with sqlite3.connect(str(api.dbpath)) as conn:
+        conn.execute("DROP TABLE sample_duplicate")
+    _main('createdb', '--update')
+    assert caplog.text.count('1 new or changed files') == 2
+    assert [dict(r) for r in api.dbquery(sql)] == [dict(r) for r in expected]
+
+
+@pytest.mark.parametrize('fmt', ['parquet', 'arrow'])
+def test_export(_main, api, tmp_path, fmt):
+    pytest.importorskip('pyarrow')
+    import pyarrow.dataset
+
+    _main('createdb')
+    _main('export', '--format', fmt, '--outdir', str(tmp_path), '--batch-size', '100')
+    fmt = 'ipc' if fmt == 'arrow' else fmt
+    for table in ['file', 'reference', 'sample', 'citation']:
+        ds = pyarrow.dataset.dataset(
+            str(tmp_path / table), format=fmt, partitioning='hive')
+        assert ds.count_rows() == api.dbquery('SELECT count(*) AS n FROM ' + table)[0]['n']
+    ds = pyarrow.dataset.dataset(str(tmp_path / 'sample'), format=fmt, partitioning='hive')
+    sections = set(ds.to_table(columns=['section']).column('section').to_pylist())
+    assert sections == {f.section for f in api.iter_files()}
+    assert ds.schema.field('SIO2(WT%)').type == pyarrow.float64()
+
+
+def test_ls(_main, api, capsys):
+    _main('ls', '--samples', '--references', '--workers', '2')
     out, _ = capsys.readouterr()
-    assert 'Cratons' in out
+    assert 'Cratons' in out and ' 426 ' in out
+    assert api.path('counts.json').exists()
+    _main('ls', '--samples', '--references', '--workers', '1')
+    assert capsys.readouterr()[0] == out
 
     _main('ls', '--datasets-only')
 
@@ -69,3 +231,275 @@ def test_check(_main, capsys):
     _main('check')
     _, err = capsys.readouterr()
     assert not err
+
+
+@pytest.mark.parametrize('workers', ['1', '2'])
+def test_timings(_main, tmp_path, caplog, workers):
+    from pygeoroc import timing
+
+    caplog.set_level(logging.INFO)
+    _main('--timings-json', str(tmp_path / 'timings.json'), 'createdb', '--workers', workers)
+    assert timing.get() is None
+    res = load(tmp_path / 'timings.json')
+    assert set(res['stages']) == {'decode', 'csv', 'sample', 'errata', 'sqlite'}
+    assert res['stages']['sample']['count'] == res['stages']['sqlite']['count'] == 426
+    assert res['files']['2022-06-1KRR1P_ZIMBABWE_CRATON_ARCHEAN.csv']['rows'] == 426
+    assert 'sqlite:' in caplog.text
+
+
+def test_profile(_main, tmp_path, capsys):
+    _main('--timings-json', '-', '--profile', 'ls')
+    out, err = capsys.readouterr()
+    assert '"stages"' in out and 'cumulative' in err
+    _main('--profile-out', str(tmp_path / 'stats'), 'ls')
+    assert tmp_path.joinpath('stats').exists()
+
+
+def test_cache(_main, api, tmp_path):
+    _main('--cache-dir', str(tmp_path / 'cache'), 'createdb')
+    expected = api.dbquery('SELECT * FROM sample ORDER BY id')
+    _main('--cache-dir', str(tmp_path / 'cache'), 'createdb', '--force', '--workers', '2')
+    assert api.dbquery('SELECT * FROM sample ORDER BY id') == expected
+    _main('--cache', 'createdb', '--force')
+    assert api.path('cache').exists()
+
+
+def test_createdb_indexes(_main, api):
+    _main('createdb', '--index', 'sample:ROCK_NAME, SIO2(WT%)', '--index', 'sample:unknown')
+    sql = "SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE 'idx_%'"
+    indexes = {r['name'] for r in api.dbquery(sql)}
+    assert {'idx_citation_sample_id_reference_id', 'idx_sample_file_id'}.issubset(indexes)
+    assert 'idx_sample_ROCK_NAME_SIO2_WT__' in indexes
+    plan = api.dbquery(
+        'EXPLAIN QUERY PLAN SELECT reference_id FROM citation WHERE sample_id = ?', ('1',))
+    assert 'COVERING INDEX idx_citation_sample_id_reference_id' in plan[0]['detail']
+
+    _main('createdb', '--force', '--no-default-indexes')
+    assert not api.dbquery(sql)
+    _main('createdb', '--update')
+    assert len(api.dbquery(sql)) == 5
+
+    with pytest.raises(SystemExit):
+        _main('createdb', '--index', 'sample')
+
+
+def test_dbquery(_main, api):
+    import threading
+
+    _main('createdb')
+    conn = api.dbconnection()
+    assert api.dbconnection() is conn
+    n = api.dbquery('SELECT count(*) AS n FROM sample')[0]['n']
+    rows = api.iter_dbquery('SELECT id FROM sample ORDER BY id', arraysize=100)
+    assert sum(1 for _ in rows) == n
+    assert list(api.iter_dbquery('CREATE TEMP TABLE t (id TEXT)')) == []
+
+    # Each thread uses its own connection:
+    res = []
+    t = threading.Thread(target=lambda: res.append(api.dbconnection()))
+    t.start()
+    t.join()
+    assert res[0] is not conn
+
+    # A recreated database is detected:
+    _main('createdb', '--force')
+    assert api.dbconnection() is not conn
+    assert api.dbquery('SELECT count(*) AS n FROM sample')[0]['n'] == n
+    api.dbclose()
+    api.dbpath.unlink()
+    assert api.dbquery("SELECT name FROM sqlite_master") == []
+
+
+def test_query(_main, api, capsys, caplog):
+    def intersects(lo, hi, mn, mx):
+        return mn is not None and min(mn, mx) <= hi and max(mn, mx) >= lo
+
+    def expected(west, south, east, north):
+        res = []
+        for r in api.dbquery('SELECT * FROM sample'):
+            lat = [r['LATITUDE_MIN'], r['LATITUDE_MAX']]
+            lon = [r['LONGITUDE_MIN'], r['LONGITUDE_MAX']]
+            if intersects(south, north, *lat) and (
+                    intersects(west, east, *lon) if west <= east else
+                    (intersects(west, 180, *lon) or intersects(-180, east, *lon))):
+                res.append(r['id'])
+        assert res
+        return sorted(res)
+
+    caplog.set_level(logging.INFO)
+    assert _main('query', '--bbox', '28', '-20', '30', '-19') == 1
+    assert 'Run `georoc createdb`' in caplog.text and not api.dbpath.exists()
+    _main('createdb', '--no-spatial-index')
+    assert not api.dbquery("SELECT name FROM sqlite_master WHERE name = 'sample_bbox'")
+    assert _main('query', '--bbox', '28', '-20', '30', '-19') == 1
+    assert 'Run `georoc createdb --update`' in caplog.text
+    _main('createdb', '--update')  # Creates the spatial index.
+    for bbox in [
+        (28, -20, 30, -19),
+        (29.5, -90, 28.5, 90),  # A box crossing the antimeridian.
+    ]:
+        assert sorted(r['id'] for r in api.samples_in_bbox(*bbox)) == expected(*bbox)
+
+    with pytest.raises(ValueError):
+        list(api.samples_in_bbox(0, 10, 10, 0))
+
+    _main('query', '--bbox', '28', '-20', '30', '-19', '--column', 'id')
+    out, _ = capsys.readouterr()
+    assert expected(28, -20, 30, -19)[0] in out
+    assert _main('query', '--bbox', '0', '10', '10', '0') == 1
+    assert 'Invalid bounding box' in caplog.text
+
+
+def test_query_update(_main, api):
+    import sqlite3
+
+    _main('createdb')
+    count = 'SELECT count(*) AS n FROM sample_bbox'
+    n = api.dbquery(count)[0]['n']
+    assert n
+    with sqlite3.connect(str(api.dbpath)) as conn:
+        conn.execute("UPDATE file SET md5 = 'x'")
+    _main('createdb', '--update')
+    assert api.dbquery(count)[0]['n'] == n
+    _main('createdb', '--update', '--fast')
+    assert api.dbquery(
+        'SELECT count(*) AS n FROM sample_bbox AS b, sample_bbox_id AS i, sample AS s '
+        'WHERE b.id = i.id AND i.sample_id = s.id '
+        'AND b.lat_min <= s.LATITUDE_MIN + 0.001 AND b.lat_max >= s.LATITUDE_MIN - 0.001'
+    )[0]['n'] == n
+
+    # The spatial index does not depend on the rowids of samples, which VACUUM or a dump and
+    # restore may change:
+    bbox = (28, -20, 30, -19)
+    expected = {r['id'] for r in api.samples_in_bbox(*bbox)}
+    with sqlite3.connect(str(api.dbpath)) as conn:
+        conn.execute("DELETE FROM citation")
+        conn.execute("CREATE TEMP TABLE s AS SELECT * FROM sample WHERE rowid % 2 = 1")
+        conn.execute("DELETE FROM sample")
+        conn.execute("INSERT INTO sample SELECT * FROM s ORDER BY rowid DESC")
+    conn.execute("VACUUM")
+    conn.close()
+    expected &= {r['id'] for r in api.dbquery('SELECT id FROM sample')}
+    assert expected and {r['id'] for r in api.samples_in_bbox(*bbox)} == expected
+
+
+def test_createdb_duplicates(_main, api):
+    import copy
+
+    _main('createdb')
+    expected = {t: api.dbquery('SELECT count(*) AS n FROM {}'.format(t))[0]['n']
+                for t in ['sample', 'citation', 'reference']}
+
+    # Add a copy of the CSV file to the index - i.e. a file with only duplicate samples:
+    md = api.index[0].md
+    f = copy.deepcopy(md['latestVersion']['files'][0])
+    shutil.copy(api.csvdir / f['dataFile']['filename'], api.csvdir / 'copy.csv')
+    f['dataFile']['filename'] = 'copy.csv'
+    md['latestVersion']['files'].append(f)
+    api.index = [md]
+
+    assert len(list(api.iter_samples())) == expected['sample']
+    _main('createdb', '--force')
+    assert api.dbquery('SELECT count(*) AS n FROM file')[0]['n'] == 2
+    for table, n in expected.items():
+        assert api.dbquery('SELECT count(*) AS n FROM {}'.format(table))[0]['n'] == n
+    assert not api.dbquery("SELECT id FROM sample WHERE file_id = 'copy.csv'")
+
+
+def test_archives(_main, api, repos, tmp_path, caplog):
+    import requests_mock
+
+    expected = [(s.id, dict(s.data)) for s, _ in api.iter_samples()]
+    csv = repos / 'csv' / '2022-06-1KRR1P_ZIMBABWE_CRATON_ARCHEAN.csv'
+    with zipfile.ZipFile(str(tmp_path / 'ds.zip'), 'w', compression=zipfile.ZIP_DEFLATED) as zip:
+        zip.write(str(csv), csv.name)
+    shutil.rmtree(str(repos / 'csv'))
+
+    api = GEOROC(repos, archives=True)
+    f = next(api.iter_files())
+    assert not f.exists(api)
+    index = repos.joinpath('datasets.json').read_text(encoding='utf8')
+
+    def content_callback(request, context):
+        if 'access' in request.url:  # archive download
+            return tmp_path.joinpath('ds.zip').read_bytes()
+        return json.dumps(dict(data=load(repos / 'datasets.json')[0])).encode('utf8')
+
+    with requests_mock.Mocker() as mock:
+        mock.get(requests_mock.ANY, content=content_callback)
+        caplog.set_level(logging.INFO)
+        _main('--archives', 'download', '--workers', '1')
+        assert 'Downloading archive' in caplog.text
+    assert not repos.joinpath('csv').exists()
+    assert repos.joinpath('archives', '1KRR1P.zip').exists()
+    # All mocked DOIs resolve to the same dataset, so we restore the index:
+    repos.joinpath('datasets.json').write_text(index, encoding='utf8')
+
+    # Archives are detected:
+    api = GEOROC(repos)
+    assert api.archives
+    f = next(api.iter_files())
+    assert f.exists(api)
+    api.checksums._data.clear()
+    assert f.exists(api), 'The checksum of the archive member is computed'
+    assert not File(dict(f.md, filename='x.csv'), archive=f.archive).exists(api)
+    assert [(s.id, dict(s.data)) for s, _ in api.iter_samples()] == expected
+    assert (f.count_samples(api), f.count_references(api)) == (426, 27)
+    assert dict(api.get_sample(expected[-1][0]).data) == expected[-1][1]
+
+    for workers in ['1', '2']:
+        _main('createdb', '--force', '--workers', workers)
+        assert len(api.dbquery('SELECT id FROM sample')) == len(expected)
+    _main('ls', '--samples', '--workers', '2')
+
+    # Outdated archives are downloaded again; corrupt downloads are detected:
+    api.checksums.add(repos / 'archives' / '1KRR1P.zip', 'x', member=f.name)
+    assert not f.exists(api)
+    with requests_mock.Mocker() as mock:
+        mock.get(requests_mock.ANY, content=tmp_path.joinpath('ds.zip').read_bytes())
+        next(api.iter_files()).md5 = 'y'
+        with pytest.raises(ValueError, match='Checksum'):
+            api.index[0].download_files(api)
+        # An archive lacking a file of the dataset is not accepted either:
+        ds = api.index[0]
+        f.md5 = f.md['md5']
+        ds.files.append(File(dict(f.md, filename='x.csv'), archive=f.archive))
+        with pytest.raises(ValueError, match='missing'):
+            ds.download_files(api)
+    assert [p.name for p in repos.joinpath('archives').iterdir()] == ['1KRR1P.zip']
+
+
+def test_createdb_update_duplicates(_main, api):
+    import copy
+
+    # Index a file and a copy of it - i.e. a file with only duplicate samples:
+    md = api.index[0].md
+    f = copy.deepcopy(md['latestVersion']['files'][0])
+    shutil.copy(api.csvdir / f['dataFile']['filename'], api.csvdir / 'copy.csv')
+    f['dataFile']['filename'] = 'copy.csv'
+    md['latestVersion']['files'].append(f)
+    api.index = [md]
+    _main('createdb')
+    assert not api.dbquery("SELECT id FROM sample WHERE file_id = 'copy.csv'")
+
+    def check(n):
+        update = {t: api.dbquery('SELECT * FROM {} ORDER BY 1, 2'.format(t))
+                  for t in ['sample', 'citation', 'sample_duplicate']}
+        assert len(update['sample']) == 426 and len(update['sample_duplicate']) == n
+        assert not api.path('offsets').exists()
+        _main('createdb', '--force')
+        for table, rows in update.items():
+            assert api.dbquery('SELECT * FROM {} ORDER BY 1, 2'.format(table)) == rows
+
+    # Removing the original file, the samples must be loaded from the copy:
+    original = md['latestVersion']['files'].pop(0)
+    api.index = [md]
+    _main('createdb', '--update')
+    check(0)
+
+    # Adding the original file in front of the copy, the samples must be loaded from it:
+    md['latestVersion']['files'].insert(0, original)
+    api.index = [md]
+    _main('createdb', '--update')
+    assert not api.dbquery("SELECT id FROM sample WHERE file_id = 'copy.csv'")
+    check(426)
@@ -0,0 +1,56 @@
+import asyncio
+
+import pytest
+import requests
+from clldutils.jsonlib import load
+
+from pygeoroc.api import Dataset, API_URL
+from pygeoroc.dataverse import Client, run_sync
+
+
+@pytest.fixture
+def metadata(repos):
+    return load(repos / 'datasets.json')[0]
+
+
+def test_Client(metadata):
+    import requests_mock
+
+    responses = [
+        dict(exc=requests.ConnectionError),
+        dict(status_code=503),
+        dict(json=dict(data=metadata)),
+    ]
+    with requests_mock.Mocker() as mock:
+        mock.get(requests_mock.ANY, responses)
+
+        async def fetch():
+            async with Client(backoff=0) as client:
+                return await client.datasets(['doi:x'])
+
+        datasets = run_sync(fetch())
+        assert datasets[0].doi == 'doi:10.25625/1KRR1P'
+        assert mock.call_count == 3
+        assert mock.last_request.url.startswith(API_URL)
+
+        mock.get(requests_mock.ANY, status_code=503)
+        with pytest.raises(requests.HTTPError):
+            run_sync(Client(retries=1, backoff=0).dataset('doi:x'))
+
+        mock.get(requests_mock.ANY, exc=requests.ConnectionError)
+        with pytest.raises(requests.ConnectionError):
+            run_sync(Client(retries=0).dataset('doi:x'))
+
+
+def test_from_doi(metadata):
+    import requests_mock
+
+    with requests_mock.Mocker() as mock:
+        mock.get(requests_mock.ANY, json=dict(data=metadata))
+        assert Dataset.from_doi('doi:x').name == 'GEOROC Compilation: Archaean Cratons'
+
+        # The synchronous API also works when called from a running event loop:
+        async def f():
+            return Dataset.from_doi('doi:x')
+
+        assert asyncio.run(f()).name == 'GEOROC Compilation: Archaean Cratons'
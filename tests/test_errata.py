@@ -1,7 +1,10 @@
+import logging
 from types import SimpleNamespace
 
+import pytest
+
 from pygeoroc.api import Sample
-from pygeoroc.errata import fix
+from pygeoroc.errata import fix, fix_columns, Plan
 
 
 def test_fix_LAND_OR_SEA(api, mocker):
@@ -15,3 +18,82 @@ def test_fix_coords(api, mocker):
         id='1', name='sample', citations='[1]', data=dict(LATITUDE_MIN='12', LONGITUDE_MIN='-12'))
     fix(sample, SimpleNamespace(name='NEW_CALEDONIA.csv'), api)
     assert sample.data['LATITUDE_MIN'] < 0 and sample.data['LONGITUDE_MIN'] > 0
+
+
+def test_fix_columns(api, mocker):
+    numpy = pytest.importorskip('numpy')
+
+    cols = dict(
+        LAND_OR_SEA=numpy.array(['abc', None], dtype=object),
+        LATITUDE_MIN=numpy.array([12, numpy.nan]),
+        LATITUDE_MAX=numpy.array([numpy.nan, numpy.nan]),
+        LONGITUDE_MIN=numpy.array([-12, 0.0]),
+        ROCK_NAME=numpy.array(['x', None], dtype=object))
+    api.converters.FIELDS['ROCK_NAME'] = lambda s, data, _: s + data['LAND_OR_SEA']
+    fix_columns(cols, SimpleNamespace(name='NEW_CALEDONIA.csv'), api)
+    assert cols['LAND_OR_SEA'][0] == 'ABC' and cols['LAND_OR_SEA'][1] is None
+    assert cols['LATITUDE_MIN'][0] == -12 and cols['LONGITUDE_MIN'][0] == 12
+    assert cols['ROCK_NAME'][0] == 'xABC'
+
+
+def test_fix_columns_data(api):
+    pytest.importorskip('numpy')
+
+    # Converters without vectorized version get the same `data` when reading columns as when
+    # reading samples:
+    calls = []
+
+    def conv(v, data, _):
+        assert len(data) == len(list(data))
+        calls.append(dict(data))
+        return '{} {}'.format(v, data.get('LATITUDE_MAX') or data['LATITUDE_MIN'])
+
+    api.converters.FIELDS['LOCATION'] = conv
+    f = next(api.iter_files())
+    cols = f.read_columns(api)
+    rows, calls[:] = calls[:], []
+    samples = list(f.iter_samples(api))
+    assert rows and rows == calls
+    assert list(cols['LOCATION']) == [s.data['LOCATION'] for s in samples]
+    assert None in rows[0].values() and 'UNIQUE_ID' not in rows[0]
+
+
+def test_Plan(api, caplog, capsys):
+    f = SimpleNamespace(name='NEW_CALEDONIA.csv')
+    samples = [
+        Sample(id=str(i), name='s', citations='', data=dict(LATITUDE_MIN='12', LAND_OR_SEA='x'))
+        for i in range(3)]
+    plan = Plan.compile(f, api, samples[0].data.header.names)
+    assert plan
+    samples[2].data['ROCK_NAME'] = 'x'  # This sample does not share the header anymore.
+    for sample in samples:
+        plan.apply(sample.data)
+    assert all(s.data['LATITUDE_MIN'] == -12 and s.data['LAND_OR_SEA'] == 'X' for s in samples)
+    caplog.set_level(logging.INFO)
+    plan.report()
+    assert 'fixed 3 values of LATITUDE_MIN in NEW_CALEDONIA.csv with negative' in caplog.text
+    assert not plan.counts
+    plan.apply(Sample(id='1', name='s', citations='', data=dict(LATITUDE_MIN='1')).data)
+    plan.report(stdout=None)
+    assert not plan.counts
+
+    plan = Plan.compile(f, api, samples[0].data.header.names)
+    plan.apply(Sample(id='1', name='s', citations='', data=dict(LAND_OR_SEA='x')).data)
+    plan.report(stdout=True)
+    assert 'LAND_OR_SEA' in capsys.readouterr()[0]
+
+
+def test_Plan_sequence(api):
+    # A FIELDS converter and a COORDINATES converter for the same column are applied in sequence,
+    # whether samples share the header or not:
+    api.converters.FIELDS['LATITUDE_MIN'] = lambda v, data, _: v + 1
+    f = SimpleNamespace(name='NEW_CALEDONIA.csv')
+    samples = [
+        Sample(id=str(i), name='s', citations='', data=dict(LATITUDE_MIN='12')) for i in range(2)]
+    plan = Plan.compile(f, api, samples[0].data.header.names)
+    assert len(plan.steps) == 2
+    samples[1].data['ROCK_NAME'] = 'x'  # This sample does not share the header anymore.
+    for sample in samples:
+        plan.apply(sample.data)
+    assert samples[0].data['LATITUDE_MIN'] == samples[1].data['LATITUDE_MIN']
+    assert samples[0].data['LATITUDE_MIN'] in (-13, -11)
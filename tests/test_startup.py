@@ -0,0 +1,50 @@
+import os
+import sys
+import subprocess
+
+import pytest
+
+# Budget (in seconds) for the cumulative import time of the `georoc` command, as reported by
+# `python -X importtime`. Can be overridden via environment variable, e.g. for slow CI machines.
+BUDGET = float(os.environ.get('PYGEOROC_IMPORT_BUDGET', '0.5'))
+# Modules which must not be imported just to start the `georoc` command:
+DEFERRED = ['pygeoroc.api', 'requests', 'tqdm', 'asyncio', 'pyarrow', 'numpy']
+
+
+def importtime(module):
+    """
+    :return: `dict` mapping names of imported modules to cumulative import time in seconds.
+    """
+    res = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import {}'.format(module)],
+        stderr=subprocess.PIPE,
+        check=True)
+    times = {}
+    for line in res.stderr.decode('utf8').splitlines():
+        if line.startswith('import time:') and '|' in line:
+            _, cumulative, name = line.split('|')
+            if cumulative.strip().isdigit():
+                times[name.strip()] = int(cumulative) / 1000000
+    return times
+
+
+def test_deferred_imports():
+    times = importtime('pygeoroc.__main__')
+    assert 'pygeoroc.__main__' in times
+    for module in DEFERRED:
+        assert module not in times, module
+
+
+def test_lazy_attributes():
+    import pygeoroc
+    from pygeoroc.api import GEOROC
+
+    assert pygeoroc.GEOROC is GEOROC
+    with pytest.raises(AttributeError):
+        pygeoroc.unknown
+
+
+def test_import_budget():
+    # Take the best of a few runs, to not measure compiling to bytecode or a cold disk cache:
+    best = min(importtime('pygeoroc.__main__')['pygeoroc.__main__'] for _ in range(3))
+    assert best < BUDGET, 'georoc imports in {:.3f}s, budget is {:.3f}s'.format(best, BUDGET)
@@ -0,0 +1,43 @@
+import logging
+
+import pytest
+
+from pygeoroc import timing
+
+
+@pytest.fixture
+def timings():
+    yield timing.enable()
+    timing.disable()
+
+
+def test_disabled():
+    items = [1, 2]
+    assert timing.get() is None
+    assert timing.timed('x', items) is items
+    with timing.stage('x'):
+        pass
+
+
+def test_Timings(timings, caplog):
+    outer = timing.timed('outer', timing.timed('inner', range(3)), file='f.csv')
+    assert list(outer) == [0, 1, 2]
+    with timing.stage('write', count=3):
+        pass
+    res = timings.as_json()
+    assert res['stages']['inner']['count'] == res['stages']['outer']['count'] == 3
+    assert res['files']['f.csv']['rows'] == 3
+    assert res['files']['f.csv']['seconds'] >= res['stages']['outer']['seconds']
+    assert res['stages']['write']['count'] == 3
+
+    other = timing.Timings()
+    other.merge(res)
+    other.merge(res)
+    assert other.as_json()['files']['f.csv']['rows'] == 6
+
+    assert timings.reset()['stages']
+    assert not timings.as_json()['stages']
+
+    caplog.set_level(logging.INFO)
+    other.report(logging.getLogger(__name__))
+    assert 'inner' in caplog.text